@@ -7,6 +7,7 @@
 
 # imports
 import time
+import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -15,7 +16,16 @@ sys.path.append("../..")
 import calandigital as cd
 from dss_common import *
 
-def main():
+parser = argparse.ArgumentParser(description="Tone calibration of a digital sideband separating receiver.")
+parser.add_argument("--resume", action="store_true", 
+    help="resume the sweeps from the checkpoints of an interrupted run.")
+
+def main(argv=None):
+    """
+    :param argv: command line arguments, sys.argv[1:] if None.
+    """
+    global resume
+    resume = parser.parse_args(argv).resume
     start_time = time.time()
     make_pre_measurements_actions()
     make_dss_measurements()
@@ -45,13 +55,15 @@ def make_dss_measurements():
     """
     print("Starting tone sweep in upper sideband...", end="")
     sweep_time = time.time()
-    a2_toneusb, b2_toneusb, ab_toneusb = get_caldata(rf_freqs_usb, "usb")
+    a2_toneusb, b2_toneusb, ab_toneusb, timing = get_caldata(rf_freqs_usb, "usb")
     print("done", int(time.time() - sweep_time), "[s]")
+    cd.print_stage_times(timing)
         
     print("Starting tone sweep in lower sideband...", end="")
     sweep_time = time.time()
-    a2_tonelsb, b2_tonelsb, ab_tonelsb = get_caldata(rf_freqs_lsb, "lsb")
+    a2_tonelsb, b2_tonelsb, ab_tonelsb, timing = get_caldata(rf_freqs_lsb, "lsb")
     print("done", int(time.time()-sweep_time), "[s]")
+    cd.print_stage_times(timing)
 
     print("Saving data...", end="")
     np.savez(cal_datadir+"/caldata", 
@@ -108,57 +120,120 @@ def get_caldata(rf_freqs, tone_sideband):
     Sweep a tone through a sideband and get the calibration data.
     The calibration data is the power of each tone in both inputs (a and b)
     and the cross-correlation of both inputs as a complex number (ab*).
-    The full sprecta measured for each tone is saved to data for debugging
-    purposes.
+    The full sprecta measured every spec_step tones are saved to data for 
+    debugging purposes, for the rest of the tones only the tone bin is read.
+    If adaptive is set, the sweep starts with bin_step and is refined where
+    needed, until adaptive_tol or max_test_bins are reached.
     :param rf_freqs: frequencies of the tones to perform the sweep (in GHz).
     :param tone_sideband: sideband of the injected test tone. Either USB or LSB
-    :return: calibration data: a2, b2, and ab.
+    :return: calibration data: a2, b2, and ab, and sweep stage times.
     """
     fig.suptitle(tone_sideband.upper() + " Tone Sweep")
 
-    a2_arr = []; b2_arr = []; ab_arr = []
-    for i, test_bin in enumerate(test_bins):
-        # set test tone
+    # plan reads of all the brams read in each step
+    spec_brams  = [bram_a2, bram_b2, bram_ab_re, bram_ab_im]
+    spec_dtypes = [pow_dtype, pow_dtype, corr_dtype, corr_dtype]
+    read_plan   = cd.plan_bram_reads(regmap, sum(spec_brams, []), bram_nbytes)
+
+    # open checkpoint, skipping the bins already done if resuming
+    checkpoint_file = cal_datadir + "/checkpoint_" + tone_sideband + ".jsonl"
+    checkpoint = cd.open_checkpoint(checkpoint_file, resume)
+    steps_done   = list(checkpoint.keys())
+    results_done = [(tone, None) for tone in checkpoint.values()]
+
+    # open store for the full spectra
+    fields = {name: (n_bins, "<f8") for name in ["a2", "b2", "ab_re", "ab_im"]}
+    nrows  = max(len(test_bins), max_bins) if adaptive else len(test_bins)
+    store  = open_rawdata_store(cal_datadir, tone_sideband, fields, nrows, resume)
+
+    def set_tone(test_bin):
         freq = rf_freqs[test_bin]
         rf_generator.query("freq " + str(freq) + " ghz; *opc?")
-        time.sleep(pause_time)
 
-        # read data
-        a2    = cd.read_interleave_data(rfsoc, bram_a2,    addr_width, data_width, pow_dtype)
-        b2    = cd.read_interleave_data(rfsoc, bram_b2,    addr_width, data_width, pow_dtype)
-        ab_re = cd.read_interleave_data(rfsoc, bram_ab_re, addr_width, data_width, corr_dtype)
-        ab_im = cd.read_interleave_data(rfsoc, bram_ab_im, addr_width, data_width, corr_dtype)
+    def settle(test_bin):
+        cd.settle_accumulations(rfsoc, acc_time, count_reg=count_reg, watch_bram=bram_a2[0])
 
-        # append data to arrays
-        a2_arr.append(a2[test_bin])
-        b2_arr.append(b2[test_bin])
-        ab_arr.append(ab_re[test_bin] + 1j*ab_im[test_bin])
+    n_reads = 0
+    def read(test_bin):
+        # read full spectra only every spec_step steps, else only the tone bin
+        nonlocal n_reads
+        read_spec = spec_step > 0 and n_reads % spec_step == 0
+        n_reads += 1
+        if read_spec:
+            specs = cd.read_interleave_data_list(rfsoc, spec_brams, 
+                addr_width, data_width, spec_dtypes, read_plan)
+            tone = [spec[test_bin] for spec in specs]
+        else:
+            specs = None
+            tone = [data[0] for data in cd.read_interleave_bins(rfsoc, 
+                spec_brams, [test_bin], data_width, spec_dtypes)]
+        return tone, specs
 
-        # scale and dBFS data for plotting
-        a2_plot = cd.scale_and_dBFS_specdata(a2, acc_len, dBFS)
-        b2_plot = cd.scale_and_dBFS_specdata(b2, acc_len, dBFS)
+    def plot(steps, results):
+        # add results from previous sweep rounds
+        steps   = steps_done + steps
+        results = results_done + results
 
         # compute input ratios for plotting
-        ab_ratios = np.divide(ab_arr, b2_arr)
+        order = np.argsort(steps)
+        steps = np.array(steps)[order]
+        ab_ratios = [(ab_re + 1j*ab_im) / b2 for (_, b2, ab_re, ab_im), _ in results]
+        ab_ratios = np.array(ab_ratios)[order]
+        lines[2].set_data(if_freqs[steps], np.abs(ab_ratios))
+        lines[3].set_data(if_freqs[steps], np.angle(ab_ratios, deg=True))
+
+        # plot last full spectra read
+        specs = [specs for _, specs in results if specs is not None]
+        if specs:
+            a2_plot, b2_plot = cd.scale_and_dBFS_specdata(np.array(specs[-1][:2]), 
+                acc_len, dBFS)
+            lines[0].set_data(if_freqs, a2_plot)
+            lines[1].set_data(if_freqs, b2_plot)
 
-        # plot data
-        lines[0].set_data(if_freqs, a2_plot)
-        lines[1].set_data(if_freqs, b2_plot)
-        lines[2].set_data(if_test_freqs[:i+1], np.abs(ab_ratios))
-        lines[3].set_data(if_test_freqs[:i+1], np.angle(ab_ratios, deg=True))
         fig.canvas.draw()
         fig.canvas.flush_events()
-        
-        # save data
-        np.savez(cal_datadir+"/rawdata_tone_" + tone_sideband + "/bin_" + 
-            str(test_bin), a2=a2, b2=b2, ab_re=ab_re, ab_im=ab_im)
+
+    def save(test_bin, data):
+        tone, specs = data
+        cd.append_checkpoint(checkpoint_file, test_bin, tone)
+        if specs is None:
+            return
+        a2, b2, ab_re, ab_im = specs
+        store.append(test_bin, a2=a2, b2=b2, ab_re=ab_re, ab_im=ab_im)
+
+    # run sweep, plotting and saving in parallel with the acquisition. If the
+    # sweep is adaptive, new rounds are run on the bins where the input
+    # ratios change quickly or disagree with the interpolation
+    timing = {}
+    new_bins = [test_bin for test_bin in test_bins if test_bin not in checkpoint]
+    while True:
+        if new_bins:
+            results, round_timing = cd.run_tone_sweep(new_bins, set_tone, settle, read, plot, save)
+            steps_done += new_bins; results_done += results
+            for stage, times in round_timing.items():
+                timing[stage] = timing.get(stage, []) + times
+        if not adaptive:
+            break
+        ab_ratios = [(ab_re + 1j*ab_im) / b2 for (_, b2, ab_re, ab_im), _ in results_done]
+        new_bins  = cd.plan_adaptive_bins(steps_done, ab_ratios, adapt_tol, max_bins)
+        if not new_bins:
+            break
+    store.close()
+
+    # get tone bin data sorted by bin
+    order  = np.argsort(steps_done)
+    tones  = np.array([tone for tone, _ in results_done])[order]
+    a2_arr = tones[:,0]
+    b2_arr = tones[:,1]
+    ab_arr = tones[:,2] + 1j*tones[:,3]
+    sweep_freqs = if_freqs[np.array(steps_done)[order]]
 
     # compute interpolations
-    a2_arr = np.interp(if_freqs, if_test_freqs, a2_arr)
-    b2_arr = np.interp(if_freqs, if_test_freqs, b2_arr)
-    ab_arr = np.interp(if_freqs, if_test_freqs, ab_arr)
+    a2_arr = np.interp(if_freqs, sweep_freqs, a2_arr)
+    b2_arr = np.interp(if_freqs, sweep_freqs, b2_arr)
+    ab_arr = np.interp(if_freqs, sweep_freqs, ab_arr)
 
-    return a2_arr, b2_arr, ab_arr
+    return a2_arr, b2_arr, ab_arr, timing
 
 def print_data():
     """
@@ -1,5 +1,5 @@
 #!/usr/bin/python
-import tarfile
+import tarfile, warnings
 import numpy as np
 
 import sys
@@ -7,6 +7,15 @@ sys.path.append("../..")
 import calandigital as cd
 from dss_common import *
 
+# last constants written into the brams, so that when constants are reloaded
+# only the changed bins are written
+const_shadow = {}
+
+# fixed point encoding options of the constants (see cd.encode_fixed()), they
+# are part of the cache key, so that constants cached with another encoding
+# (e.g. wrapped around instead of saturated) are not reused
+const_encoding = {"rounding": "truncate", "saturate": True}
+
 def dss_load_constants(rfsoc, load_ideal, ideal_const, caltar):
     """
     Load load digital sideband separation constants.
@@ -14,25 +23,34 @@ def dss_load_constants(rfsoc, load_ideal, ideal_const, caltar):
     :param load_ideal: if True, load ideal constant, else use calibration 
         constants from caltar.
     :param ideal_const: ideal constant value to load.
-    :param caltar: .tar.gz file with the calibration data.
+    :param caltar: .cds (or old .tar.gz) file with the calibration data.
+        The fixed point constants computed from it are cached in const_cache, 
+        keyed by the hash of the file, the fixed point format and encoding,
+        and the brams.
     """
     if load_ideal:
         print("Using ideal constant", str(ideal_const))
         consts_usb = ideal_const * np.ones(n_bins, dtype=np.complex64)
         consts_lsb = ideal_const * np.ones(n_bins, dtype=np.complex64)
+        bram_data  = get_consts_bramdata(consts_usb, consts_lsb)
     else: # use calibrated constants
         print("Using constants from calibration directory")
-        consts_lsb, consts_usb = compute_consts(caltar)
+        # the cached data is keyed by bram name, so the brams (in their usb
+        # and lsb roles) and the constants mode are part of the key
+        const_brams = [bram_cusb_re, bram_cusb_im, bram_clsb_re, bram_clsb_im]
+        key = cd.get_file_hash(caltar, const_nbits, const_binpt, const_encoding,
+            "calibrated", const_brams)
+        bram_data = cd.get_cached_bram_data(const_cache, key, 
+            lambda: get_consts_bramdata(*compute_consts(caltar)[::-1]))
 
     print("Loading constants...", end="")
-    load_comp_constants(rfsoc, consts_usb, bram_cusb_re, bram_cusb_im)
-    load_comp_constants(rfsoc, consts_lsb, bram_clsb_re, bram_clsb_im)
+    cd.write_bram_data(rfsoc, bram_data, const_shadow, regmap=regmap)
     print("done")
 
 def compute_consts(caltar):
     """
     Compute constants using tone calibration info.
-    :param caltar: calibration .tar.gz file.
+    :param caltar: calibration .cds (or old .tar.gz) file.
     :return: calibration constants.
     """
     caldata = get_caldata(caltar)
@@ -51,30 +69,46 @@ def compute_consts(caltar):
 
 def get_caldata(datatar):
     """
-    Extract calibration data from directory compressed as .tar.gz.
+    Get calibration data from a sweep store (.cds) file. Old calibration
+    directories compressed as .tar.gz are also accepted.
     """
-    tar_file = tarfile.open(datatar)
-    caldata = np.load(tar_file.extractfile("caldata.npz"))
+    if datatar.endswith(".tar.gz"):
+        tar_file = tarfile.open(datatar)
+        caldata = np.load(tar_file.extractfile("caldata.npz"))
+    else:
+        caldata = cd.read_sweep_store(datatar, prefix="caldata/")
 
     return caldata
 
-def load_comp_constants(rfsoc, consts, bram_re, bram_im):
+def get_consts_bramdata(consts_usb, consts_lsb):
+    """
+    Get the data to load into the RFSoC brams for the usb and lsb constants.
+    :param consts_usb: complex usb constants array.
+    :param consts_lsb: complex lsb constants array.
+    :return: dictionary with the fixed point data to write into each bram.
+    """
+    bram_data = {}
+    bram_data.update(get_comp_bramdata(consts_usb, bram_cusb_re, bram_cusb_im))
+    bram_data.update(get_comp_bramdata(consts_lsb, bram_clsb_re, bram_clsb_im))
+    return bram_data
+
+def get_comp_bramdata(consts, bram_re, bram_im):
     """
-    Load complex constants into RFSoC bram. Real and imaginary parts
-    are loaded in separated bram blocks.
-    :param rfsoc: FpgaClient object to communicate with RFSoC
+    Get the data to load complex constants into RFSoC bram. Real and 
+    imaginary parts are loaded in separated bram blocks. Overflowed values
+    are saturated.
     :param consts: complex constants array.
     :param bram_re: bram block name for real part.
     :param bram_im: bram block name for imaginary part.
+    :return: dictionary with the fixed point data to write into each bram.
     """
-    # separate real and imaginary
-    consts_re = np.real(consts)
-    consts_im = np.imag(consts)
-
-    # convert data into fixed point representation
-    consts_re_fixed = cd.float2fixed(consts_re, const_nbits, const_binpt)
-    consts_im_fixed = cd.float2fixed(consts_im, const_nbits, const_binpt)
+    # convert data into fixed point representation, deinterleaved into brams
+    brams = bram_re + bram_im
+    consts_fixed, noverflow = cd.encode_fixed(np.asarray(consts, dtype=complex), 
+        const_nbits, const_binpt, nbrams=len(bram_re), **const_encoding)
+    if noverflow > 0:
+        warnings.warn(str(noverflow) + " constant values saturated in " + \
+            "fixed point conversion.")
 
-    # load data
-    cd.write_interleaved_data(rfsoc, bram_re, consts_re_fixed)
-    cd.write_interleaved_data(rfsoc, bram_im, consts_im_fixed)
+    bram_data = dict(zip(brams, consts_fixed.reshape(len(brams), -1)))
+    return bram_data
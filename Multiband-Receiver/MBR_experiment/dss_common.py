@@ -1,4 +1,4 @@
-import os, tomli, json, tarfile, shutil, pyvisa
+import os, tomli, json, shutil, pyvisa
 import numpy as np
 from datetime import datetime
 import calandigital as cd
@@ -18,17 +18,22 @@ dBFS        = config["spectra"]["dBFS"]
 dss_band    = config["dss"]["dss_band"]
 const_nbits = config["dss"]["const_nbits"]
 const_binpt = config["dss"]["const_binpt"]
+const_cache = config["dss"].get("const_cache", "const_cache")
 spec_brams  = config[dss_band]["spec_brams"]
 corr_brams  = config[dss_band]["corr_brams"]
 synth_brams = config[dss_band]["synth_brams"]
 const_brams = config[dss_band]["const_brams"]
+sidebands   = config[dss_band].get("sidebands", ["lsb", "usb"])
 lo_freq     = config[dss_band]["lo_freq"]
 cal_datadir = config[dss_band]["cal_datadir"]
 srr_datadir = config[dss_band]["srr_datadir"]
 cal_tar     = config[dss_band]["cal_tar"]
 rf_power    = config["experiment"]["rf_power"]
 bin_step    = config["experiment"]["bin_step"]
-pause_time  = config["experiment"]["pause_time"]
+spec_step   = config["experiment"].get("spec_step", 1)
+adaptive    = config["experiment"].get("adaptive", False)
+adapt_tol   = config["experiment"].get("adaptive_tol", 0.05)
+count_reg   = config["spectra"].get("count_reg")
 rf_genname  = config["experiment"]["rf_generator"]
 load_consts = config["experiment"]["load_consts"]
 load_ideal  = config["experiment"]["load_ideal"]
@@ -37,6 +42,7 @@ load_ideal  = config["experiment"]["load_ideal"]
 n_bins        = 2**addr_width * len(spec_brams[0])
 if_freqs      = np.linspace(0, bandwidth, n_bins, endpoint=False) # MHz
 test_bins     = range(1, n_bins, bin_step)
+max_bins      = config["experiment"].get("max_test_bins", n_bins)
 if_test_freqs = if_freqs[test_bins] # MHz
 rf_freqs_usb  = lo_freq + (if_freqs/1e3) # GHz
 rf_freqs_lsb  = lo_freq - (if_freqs/1e3) # GHz
@@ -44,21 +50,27 @@ bram_a2       = spec_brams[0]
 bram_b2       = spec_brams[1] 
 bram_ab_re    = corr_brams[0]
 bram_ab_im    = corr_brams[1]
-bram_lsb      = synth_brams[0]
-bram_usb      = synth_brams[1]
-bram_clsb_re  = const_brams[0][0]
-bram_clsb_im  = const_brams[0][1]
-bram_cusb_re  = const_brams[1][0]
-bram_cusb_im  = const_brams[1][1]
+bram_usb      = synth_brams[sidebands.index("usb")]
+bram_lsb      = synth_brams[sidebands.index("lsb")]
+bram_cusb_re  = const_brams[sidebands.index("usb")][0]
+bram_cusb_im  = const_brams[sidebands.index("usb")][1]
+bram_clsb_re  = const_brams[sidebands.index("lsb")][0]
+bram_clsb_im  = const_brams[sidebands.index("lsb")][1]
 pow_dtype     = ">u" + str(data_width//8)
 corr_dtype    = ">i" + str(data_width//8)
+bram_nbytes   = 2**addr_width * data_width//8
+regmap        = cd.get_register_map(config["bitfile"])
+acc_time      = cd.get_acc_time(n_bins, bandwidth, acc_len) # s
 
 # create RFSoC
 rfsoc = cd.initialize_rfsoc(config)
 #rfsoc = cd.DummyRFSoC()
 
-# create RF generator
-rm = pyvisa.ResourceManager("@py")
+# create RF generator, simulated with the rfsoc inputs if simulating
+if config.get("simulate"):
+    rm = cd.SimResourceManager(rfsoc, lo_freq)
+else:
+    rm = pyvisa.ResourceManager("@py")
 #rm = pyvisa.ResourceManager("@sim")
 rf_generator = rm.open_resource(rf_genname)
 
@@ -71,6 +83,10 @@ testinfo["bandwidth"]    = bandwidth
 testinfo["nbins"]        = n_bins
 testinfo["acc_len"]      = acc_len
 testinfo["bin_step"]     = bin_step
+testinfo["spec_step"]    = spec_step
+testinfo["adaptive"]     = adaptive
+testinfo["adaptive_tol"] = adapt_tol
+testinfo["max_bins"]     = max_bins
 testinfo["lo_freq"]      = lo_freq
 testinfo["rf_generator"] = rf_genname
 testinfo["rf power"]     = rf_power
@@ -87,9 +103,21 @@ def make_data_directory(datadir):
     with open(datadir + "/testinfo.json", "w") as f:
         json.dump(testinfo, f, indent=4, sort_keys=True)
 
-    # make rawdata folders
-    os.makedirs(datadir + "/rawdata_tone_usb", exist_ok=True)
-    os.makedirs(datadir + "/rawdata_tone_lsb", exist_ok=True)
+def open_rawdata_store(datadir, tone_sideband, fields, nrows, resume):
+    """
+    Open the sweep store where to save the full spectra measured in a tone
+    sweep (datadir/rawdata_tone_<sideband>.cds).
+    :param datadir: measurement data directory.
+    :param tone_sideband: sideband of the injected test tone.
+    :param fields: dictionary with the (size, dtype) of each spectrum saved.
+    :param nrows: maximum number of spectra saved of each field.
+    :param resume: if True and the store exists, append to it.
+    :return: SweepStore object.
+    """
+    store_file = datadir + "/rawdata_tone_" + tone_sideband + ".cds"
+    if resume and os.path.exists(store_file):
+        return cd.SweepStore(store_file, "r+")
+    return cd.create_sweep_store(store_file, nrows, fields, testinfo)
 
 def rfsoc_initialization():
     # set accumulation and reset counters
@@ -126,12 +154,26 @@ def make_post_measurements_actions(datadir):
 
 def compress_data(datadir):
     """
-    Compress the data from the datadir directory into a .tar.gz
-    file and delete the original directory.
+    Pack the data from the datadir directory into a single compressed sweep
+    store file (datadir.cds) and delete the original directory. Arrays from
+    sweep stores and .npz files are saved as <file name>/<array name>, and
+    other files are saved as raw bytes in files/<file name>.
     :param datair: directory to compress.
     """
-    tar = tarfile.open(datadir + ".tar.gz", "w:gz")
-    for datafile in os.listdir(datadir):
-        tar.add(datadir + "/" + datafile, datafile)
-    tar.close()
+    arrays = {}
+    for datafile in sorted(os.listdir(datadir)):
+        filepath = datadir + "/" + datafile
+        name, ext = os.path.splitext(datafile)
+        if ext == ".cds":
+            store = cd.SweepStore(filepath)
+            for field in store.fields:
+                arrays[name + "/" + field] = store[field][:store.count]
+        elif ext == ".npz":
+            with np.load(filepath) as npzdata:
+                for field in npzdata.files:
+                    arrays[name + "/" + field] = npzdata[field]
+        else:
+            with open(filepath, "rb") as f:
+                arrays["files/" + datafile] = np.frombuffer(f.read(), np.uint8)
+    cd.write_sweep_store(datadir + ".cds", arrays, testinfo)
     shutil.rmtree(datadir)
@@ -6,6 +6,7 @@
 
 # imports
 import time
+import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 from dss_load_constants import dss_load_constants
@@ -15,7 +16,16 @@ sys.path.append("../..")
 import calandigital as cd
 from dss_common import *
 
-def main():
+parser = argparse.ArgumentParser(description="SRR computation of a digital sideband separating receiver.")
+parser.add_argument("--resume", action="store_true", 
+    help="resume the sweeps from the checkpoints of an interrupted run.")
+
+def main(argv=None):
+    """
+    :param argv: command line arguments, sys.argv[1:] if None.
+    """
+    global resume
+    resume = parser.parse_args(argv).resume
     start_time = time.time()
     make_pre_measurements_actions()
     make_dss_measurements()
@@ -49,13 +59,15 @@ def make_dss_measurements():
 
     print("Starting tone sweep in upper sideband...", end="", flush=True)
     sweep_time = time.time()
-    usb_toneusb, lsb_toneusb = get_srrdata(rf_freqs_usb, "usb")
+    usb_toneusb, lsb_toneusb, timing = get_srrdata(rf_freqs_usb, "usb")
     print("done", int(time.time() - sweep_time), "[s]")
+    cd.print_stage_times(timing)
         
     print("Starting tone sweep in lower sideband...", end="", flush=True)
     sweep_time = time.time()
-    usb_tonelsb, lsb_tonelsb = get_srrdata(rf_freqs_lsb, "lsb")
+    usb_tonelsb, lsb_tonelsb, timing = get_srrdata(rf_freqs_lsb, "lsb")
     print("done", int(time.time() - sweep_time), "[s]")
+    cd.print_stage_times(timing)
 
     print("Saving data...", end="", flush=True)
     np.savez(srr_datadir+"/srrdata", 
@@ -106,58 +118,106 @@ def get_srrdata(rf_freqs, tone_sideband):
     Sweep a tone through a sideband and get the srr data.
     The srr data is the power of each tone after applying the calibration
     constants for each sideband (usb and lsb).
-    The full sprecta measured for each tone is saved to data for debugging
-    purposes.
+    The full sprecta measured every spec_step tones are saved to data for 
+    debugging purposes, for the rest of the tones only the tone bin is read.
     :param rf_freqs: frequencies of the tones to perform the sweep (in GHz).
     :param tone_sideband: sideband of the injected test tone. Either USB or LSB
-    :return: srr data: usb and lsb.
+    :return: srr data: usb and lsb, and sweep stage times.
     """
     fig.suptitle(tone_sideband.upper() + " Tone Sweep, Band: " + dss_band)
 
-    usb_arr = []; lsb_arr = []
-    for i, test_bin in enumerate(test_bins):
-        # set test tone
+    # plan reads of all the brams read in each step
+    read_plan = cd.plan_bram_reads(regmap, bram_usb+bram_lsb, bram_nbytes)
+
+    # open checkpoint, skipping the bins already done if resuming
+    checkpoint_file = srr_datadir + "/checkpoint_" + tone_sideband + ".jsonl"
+    checkpoint = cd.open_checkpoint(checkpoint_file, resume)
+    steps_done   = list(checkpoint.keys())
+    results_done = [(tone, None) for tone in checkpoint.values()]
+
+    # open store for the full spectra
+    fields = {name: (n_bins, "<f8") for name in ["usb", "lsb"]}
+    store  = open_rawdata_store(srr_datadir, tone_sideband, fields, len(test_bins), resume)
+
+    def set_tone(test_bin):
         freq = rf_freqs[test_bin]
         rf_generator.query("freq " + str(freq) + " ghz; *opc?")
-        time.sleep(pause_time)
 
-        # read data
-        usb = cd.read_interleave_data(rfsoc, bram_usb, addr_width, data_width, pow_dtype)
-        lsb = cd.read_interleave_data(rfsoc, bram_lsb, addr_width, data_width, pow_dtype)
+    def settle(test_bin):
+        cd.settle_accumulations(rfsoc, acc_time, count_reg=count_reg, watch_bram=bram_usb[0])
 
-        # append data to arrays
-        usb_arr.append(usb[test_bin])
-        lsb_arr.append(lsb[test_bin])
+    n_reads = 0
+    def read(test_bin):
+        # read full spectra only every spec_step steps, else only the tone bin
+        nonlocal n_reads
+        read_spec = spec_step > 0 and n_reads % spec_step == 0
+        n_reads += 1
+        if read_spec:
+            specs = cd.read_interleave_data_list(rfsoc, [bram_usb, bram_lsb], 
+                addr_width, data_width, pow_dtype, read_plan)
+            tone = [spec[test_bin] for spec in specs]
+        else:
+            specs = None
+            tone = [data[0] for data in cd.read_interleave_bins(rfsoc, 
+                [bram_usb, bram_lsb], [test_bin], data_width, pow_dtype)]
+        return tone, specs
 
-        # scale and dBFS data for plotting
-        usb_plot = cd.scale_and_dBFS_specdata(usb, acc_len, dBFS)
-        lsb_plot = cd.scale_and_dBFS_specdata(lsb, acc_len, dBFS)
+    def plot(steps, results):
+        # add results from checkpoint
+        steps   = steps_done + steps
+        results = results_done + results
 
         # compute srr for plotting
+        order = np.argsort(steps)
+        steps = np.array(steps)[order]
+        usb_tones = np.array([usb for (usb, _), _ in results])[order]
+        lsb_tones = np.array([lsb for (_, lsb), _ in results])[order]
         if tone_sideband=="usb":
-            srr = np.divide(usb_arr, lsb_arr)
+            srr = np.divide(usb_tones, lsb_tones)
         else: # tone_sideband=="lsb
-            srr = np.divide(lsb_arr, usb_arr)
+            srr = np.divide(lsb_tones, usb_tones)
 
         # define sb plot line
         line_sb = lines[2] if tone_sideband=="usb" else lines[3]
+        line_sb.set_data(if_freqs[steps], 10*np.log10(srr))
+
+        # plot last full spectra read
+        specs = [specs for _, specs in results if specs is not None]
+        if specs:
+            usb_plot, lsb_plot = cd.scale_and_dBFS_specdata(np.array(specs[-1]), 
+                acc_len, dBFS)
+            lines[0].set_data(if_freqs, usb_plot)
+            lines[1].set_data(if_freqs, lsb_plot)
 
-        # plot data
-        lines[0].set_data(if_freqs, usb_plot)
-        lines[1].set_data(if_freqs, lsb_plot)
-        line_sb.set_data(if_test_freqs[:i+1], 10*np.log10(srr))
         fig.canvas.draw()
         fig.canvas.flush_events()
-        
-        # save data
-        np.savez(srr_datadir+"/rawdata_tone_" + tone_sideband + "/bin_" + \
-        str(test_bin), usb=usb, lsb=lsb)
+
+    def save(test_bin, data):
+        tone, specs = data
+        cd.append_checkpoint(checkpoint_file, test_bin, tone)
+        if specs is None:
+            return
+        usb, lsb = specs
+        store.append(test_bin, usb=usb, lsb=lsb)
+
+    # run sweep, plotting and saving in parallel with the acquisition
+    new_bins = [test_bin for test_bin in test_bins if test_bin not in checkpoint]
+    results, timing = cd.run_tone_sweep(new_bins, set_tone, settle, read, plot, save)
+    steps_done += new_bins; results_done += results
+    store.close()
+
+    # get tone bin data sorted by bin
+    order  = np.argsort(steps_done)
+    tones  = np.array([tone for tone, _ in results_done])[order]
+    usb_arr = tones[:,0]
+    lsb_arr = tones[:,1]
+    sweep_freqs = if_freqs[np.array(steps_done)[order]]
 
     # compute interpolations
-    usb_arr = np.interp(if_freqs, if_test_freqs, usb_arr)
-    lsb_arr = np.interp(if_freqs, if_test_freqs, lsb_arr)
+    usb_arr = np.interp(if_freqs, sweep_freqs, usb_arr)
+    lsb_arr = np.interp(if_freqs, sweep_freqs, lsb_arr)
 
-    return usb_arr, lsb_arr
+    return usb_arr, lsb_arr, timing
 
 def print_data():
     """
@@ -183,8 +243,8 @@ def print_data():
     plt.savefig(srr_datadir+"/srr.pdf")
 
     # compute power
-    usb_power = cd.scale_and_dBFS_specdata(usb_toneusb, acc_len, dBFS)
-    lsb_power = cd.scale_and_dBFS_specdata(lsb_tonelsb, acc_len, dBFS)
+    usb_power, lsb_power = cd.scale_and_dBFS_specdata(
+        np.array([usb_toneusb, lsb_tonelsb]), acc_len, dBFS)
     
     # print power
     plt.figure()
@@ -18,6 +18,7 @@ def main():
     reset_reg    = config["spectra"]["reset_reg"]
     acc_reg      = config["spectra"]["acc_reg"]
     acc_len      = config["spectra"]["acc_len"]
+    decimate     = config["spectra"].get("decimate", False)
     synth_band1  = config["dss1"]["synth_brams"]
     synth_band2  = config["dss2"]["synth_brams"]
     invert_reg   = config["multiband"]["invert_reg"]
@@ -41,7 +42,7 @@ def main():
     #rfsoc = cd.DummyRFSoC()
 
     # create figure
-    fig, lines = create_figure(bandwidth, combined_freq, dBFS)
+    fig, lines, rate_text = create_figure(bandwidth, combined_freq, dBFS)
     
     # initial setting of registers
     print("Setting accumulation register to ", acc_len, "...", end="")
@@ -55,36 +56,54 @@ def main():
     rfsoc.write_int(reset_reg, 0)
     print("done")
 
+    # plan reads of all spectra brams for each frame
+    spec_brams = [synth_band1[0], synth_band1[1], comb_brams, synth_band2[0], synth_band2[1]]
+    regmap = cd.get_register_map(config["bitfile"])
+    plan   = cd.plan_bram_reads(regmap, sum(spec_brams, []), 2**addr_width*data_width//8)
+
+    # acquire spectra in background, the animation shows the latest frame
+    def acquire(frame):
+        cd.read_interleave_data_list(rfsoc, spec_brams, addr_width, data_width, dtype, plan, frame)
+        return frame
+    acquisition = cd.AcquisitionThread(acquire, lambda: np.empty((len(spec_brams), n_bins)))
+    acquisition.start()
+    render_rate = cd.RateCounter()
+
+    # decimate lines to the axes pixel width
+    line_freqs = [freqs, uncombined_freqs, combined_freqs, combined_freqs, 
+                  uncombined_freqs, combined_freqs, freqs]
+    decimators = [cd.MinMaxDecimator(line.axes, line_freq, decimate) 
+        for line, line_freq in zip(lines, line_freqs)]
+
     # animation definition
     def animate(_):
+        render_rate.tick()
+        rate_text.set_text("acq: %.1f fps, render: %.1f fps" % 
+            (acquisition.rate.get_rate(), render_rate.get_rate()))
+        frame = acquisition.get_latest()
+        if frame is None:
+            return lines + [rate_text]
+        b1_lsb, b1_usb, combined, b2_lsb, b2_usb = \
+            cd.scale_and_dBFS_specdata(frame, acc_len, dBFS, out=frame)
+
         # band 1 LSB
-        spec_data = cd.read_interleave_data(rfsoc, synth_band1[0], addr_width, data_width, dtype)
-        spec_data = cd.scale_and_dBFS_specdata(spec_data, acc_len, dBFS)
-        lines[0].set_data(freqs, spec_data)
+        lines[0].set_data(*decimators[0](b1_lsb))
 
         # band 1 USB
-        spec_data = cd.read_interleave_data(rfsoc, synth_band1[1], addr_width, data_width, dtype)
-        spec_data = cd.scale_and_dBFS_specdata(spec_data, acc_len, dBFS)
-        lines[1].set_data(uncombined_freqs, spec_data[:combined_bin])
-        lines[2].set_data(combined_freqs, spec_data[combined_bin:])
+        lines[1].set_data(*decimators[1](b1_usb[:combined_bin]))
+        lines[2].set_data(*decimators[2](b1_usb[combined_bin:]))
 
         # combined band
-        spec_data = cd.read_interleave_data(rfsoc, comb_brams, addr_width, data_width, dtype)
-        spec_data = cd.scale_and_dBFS_specdata(spec_data, acc_len, dBFS)
-        lines[3].set_data(combined_freqs, spec_data[combined_bin:])
+        lines[3].set_data(*decimators[3](combined[combined_bin:]))
         
         # band 2 LSB
-        spec_data = cd.read_interleave_data(rfsoc, synth_band2[0], addr_width, data_width, dtype)
-        spec_data = cd.scale_and_dBFS_specdata(spec_data, acc_len, dBFS)
-        lines[4].set_data(uncombined_freqs, spec_data[:combined_bin])
-        lines[5].set_data(combined_freqs, spec_data[combined_bin:])
+        lines[4].set_data(*decimators[4](b2_lsb[:combined_bin]))
+        lines[5].set_data(*decimators[5](b2_lsb[combined_bin:]))
 
         # band 2 USB
-        spec_data = cd.read_interleave_data(rfsoc, synth_band2[1], addr_width, data_width, dtype)
-        spec_data = cd.scale_and_dBFS_specdata(spec_data, acc_len, dBFS)
-        lines[6].set_data(freqs, spec_data)
+        lines[6].set_data(*decimators[6](b2_usb))
 
-        return lines
+        return lines + [rate_text]
 
     ani = FuncAnimation(fig, animate, blit=True, cache_frame_data=False)
     plt.show()
@@ -140,8 +159,12 @@ def create_figure(bandwidth, combined_freq, dBFS):
     axes[4].set_title("Band2 USB")
     line, = axes[4].plot([], [], animated=True, color="blue")
     lines.append(line)
+
+    # acquisition and render rates
+    rate_text = axes[0].text(0.02, 0.98, "", transform=axes[0].transAxes, 
+        va="top", animated=True)
  
-    return fig, lines
+    return fig, lines, rate_text
 
 if __name__ == "__main__":
     main()
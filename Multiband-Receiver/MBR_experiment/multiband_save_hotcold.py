@@ -6,7 +6,20 @@ import sys
 sys.path.append("../..")
 import calandigital as cd
 
-def main():
+def wait_load(load, rfsoc):
+    """
+    Wait for the user to set the load of a measurement.
+    :param load: "cold" or "hot".
+    :param rfsoc: rfsoc object.
+    """
+    input("Set the load to " + load + " and press Enter")
+
+def main(set_load=wait_load):
+    """
+    :param set_load: function set_load(load, rfsoc) that sets the load
+        ("cold" or "hot") before each measurement. By default the user is
+        asked to set it.
+    """
     # get config data
     with open("mbr_config.toml", "rb") as f:
         config = tomllib.load(f)
@@ -42,6 +55,11 @@ def main():
     combined_freqs = freqs[combined_bin:]
     rf_freqs_comb = lo_freq1 + combined_freqs/1e3
 
+    # plan reads of all spectra brams
+    spec_brams = [synth_band1[0], synth_band1[1], synth_band2[0], synth_band2[1], comb_brams]
+    regmap = cd.get_register_map(config["bitfile"])
+    plan   = cd.plan_bram_reads(regmap, sum(spec_brams, []), 2**addr_width*data_width//8)
+
     # initialize rfsoc
     rfsoc = cd.initialize_rfsoc(config)
     #rfsoc = cd.DummyRFSoC()
@@ -58,23 +76,17 @@ def main():
     #rfsoc.write_int(reset_reg, 0)
     #print("done")
 
-    input("Set the load to cold and press Enter")
+    set_load("cold", rfsoc)
     print("Getting cold data...", end="", flush=True)
-    b1_lsb_cold = cd.read_interleave_data(rfsoc, synth_band1[0], addr_width, data_width, dtype)
-    b1_usb_cold = cd.read_interleave_data(rfsoc, synth_band1[1], addr_width, data_width, dtype)
-    b2_lsb_cold = cd.read_interleave_data(rfsoc, synth_band2[0], addr_width, data_width, dtype)
-    b2_usb_cold = cd.read_interleave_data(rfsoc, synth_band2[1], addr_width, data_width, dtype)
-    combined_cold = cd.read_interleave_data(rfsoc, comb_brams, addr_width, data_width, dtype)
+    b1_lsb_cold, b1_usb_cold, b2_lsb_cold, b2_usb_cold, combined_cold = \
+        cd.read_interleave_data_list(rfsoc, spec_brams, addr_width, data_width, dtype, plan)
     combined_cold = np.flip(combined_cold[combined_bin:])
     print("done")
 
-    input("Set the load to hot and press Enter")
+    set_load("hot", rfsoc)
     print("Getting hot data...", end="", flush=True)
-    b1_lsb_hot = cd.read_interleave_data(rfsoc, synth_band1[0], addr_width, data_width, dtype)
-    b1_usb_hot = cd.read_interleave_data(rfsoc, synth_band1[1], addr_width, data_width, dtype)
-    b2_lsb_hot = cd.read_interleave_data(rfsoc, synth_band2[0], addr_width, data_width, dtype)
-    b2_usb_hot = cd.read_interleave_data(rfsoc, synth_band2[1], addr_width, data_width, dtype)
-    combined_hot = cd.read_interleave_data(rfsoc, comb_brams, addr_width, data_width, dtype)
+    b1_lsb_hot, b1_usb_hot, b2_lsb_hot, b2_usb_hot, combined_hot = \
+        cd.read_interleave_data_list(rfsoc, spec_brams, addr_width, data_width, dtype, plan)
     combined_hot = np.flip(combined_hot[combined_bin:])
     print("done")
 
@@ -135,38 +147,35 @@ def main():
              rf_freqs_lsb2 = rf_freqs_lsb2,
              rf_freqs_comb = rf_freqs_comb)
 
+    # convert all spectra to dBFS at once
+    bands_dBFS = cd.scale_and_dBFS_specdata(np.array([
+        b1_lsb_cold, b1_usb_cold, b2_lsb_cold, b2_usb_cold,
+        b1_lsb_hot,  b1_usb_hot,  b2_lsb_hot,  b2_usb_hot]), acc_len, dBFS)
+    comb_dBFS  = cd.scale_and_dBFS_specdata(np.array([combined_cold, combined_hot]), 
+        acc_len, dBFS)
+
     # plot hotcold
     plt.figure()
     # B1 LSB cold
-    spec_data = cd.scale_and_dBFS_specdata(b1_lsb_cold, acc_len, dBFS)
-    plt.plot(rf_freqs_lsb1, spec_data, "b")
+    plt.plot(rf_freqs_lsb1, bands_dBFS[0], "b")
     # B1 USB cold
-    spec_data = cd.scale_and_dBFS_specdata(b1_usb_cold, acc_len, dBFS)
-    plt.plot(rf_freqs_usb1, spec_data, "b")
+    plt.plot(rf_freqs_usb1, bands_dBFS[1], "b")
     # B2 LSB cold
-    spec_data = cd.scale_and_dBFS_specdata(b2_lsb_cold, acc_len, dBFS)
-    plt.plot(rf_freqs_lsb2, spec_data, "b")
+    plt.plot(rf_freqs_lsb2, bands_dBFS[2], "b")
     # B2 USB cold
-    spec_data = cd.scale_and_dBFS_specdata(b2_usb_cold, acc_len, dBFS)
-    plt.plot(rf_freqs_usb2, spec_data, "b")
+    plt.plot(rf_freqs_usb2, bands_dBFS[3], "b")
     # combined band cold
-    spec_data = cd.scale_and_dBFS_specdata(combined_cold, acc_len, dBFS)
-    plt.plot(rf_freqs_comb, spec_data)
+    plt.plot(rf_freqs_comb, comb_dBFS[0])
     # B1 LSB hot
-    spec_data = cd.scale_and_dBFS_specdata(b1_lsb_hot, acc_len, dBFS)
-    plt.plot(rf_freqs_lsb1, spec_data, "r")
+    plt.plot(rf_freqs_lsb1, bands_dBFS[4], "r")
     # B1 USB hot
-    spec_data = cd.scale_and_dBFS_specdata(b1_usb_hot, acc_len, dBFS)
-    plt.plot(rf_freqs_usb1, spec_data, "r")
+    plt.plot(rf_freqs_usb1, bands_dBFS[5], "r")
     # B2 LSB hot
-    spec_data = cd.scale_and_dBFS_specdata(b2_lsb_hot, acc_len, dBFS)
-    plt.plot(rf_freqs_lsb2, spec_data, "r")
+    plt.plot(rf_freqs_lsb2, bands_dBFS[6], "r")
     # B2 USB hot
-    spec_data = cd.scale_and_dBFS_specdata(b2_usb_hot, acc_len, dBFS)
-    plt.plot(rf_freqs_usb2, spec_data, "r")
+    plt.plot(rf_freqs_usb2, bands_dBFS[7], "r")
     # combined band hot
-    spec_data = cd.scale_and_dBFS_specdata(combined_hot, acc_len, dBFS)
-    plt.plot(rf_freqs_comb, spec_data)
+    plt.plot(rf_freqs_comb, comb_dBFS[1])
     plt.savefig("hotcold.png")
 
     # plot temperature
@@ -32,6 +32,7 @@ def main():
     dtype   = ">u" + str(data_width//8)
     n_bins  = 2**addr_width * n_brams 
     freqs   = np.linspace(0, bandwidth, n_bins, endpoint=False)
+    frame   = np.empty((3, n_bins))
 
     # invert parameters
     combined_bin = (2**addr_width-invert_delay) * n_brams
@@ -59,22 +60,20 @@ def main():
 
     # animation definition
     def animate(_):
+        # get band 1, band 2, and combined band
+        cd.read_interleave_data_list(rfsoc, bram_names[:3], addr_width, data_width, dtype, out=frame)
+        band1, band2, combined = cd.scale_and_dBFS_specdata(frame, acc_len, dBFS, out=frame)
+
         # band 1
-        spec_data = cd.read_interleave_data(rfsoc, bram_names[0], addr_width, data_width, dtype)
-        spec_data = cd.scale_and_dBFS_specdata(spec_data, acc_len, dBFS)
-        lines[0].set_data(uncombined_freqs, spec_data[:combined_bin])
-        lines[1].set_data(combined_freqs, spec_data[combined_bin:])
+        lines[0].set_data(uncombined_freqs, band1[:combined_bin])
+        lines[1].set_data(combined_freqs, band1[combined_bin:])
 
         # combined band
-        spec_data = cd.read_interleave_data(rfsoc, bram_names[2], addr_width, data_width, dtype)
-        spec_data = cd.scale_and_dBFS_specdata(spec_data, acc_len, dBFS)
-        lines[2].set_data(combined_freqs, spec_data[combined_bin:])
+        lines[2].set_data(combined_freqs, combined[combined_bin:])
 
         # band 2
-        spec_data = cd.read_interleave_data(rfsoc, bram_names[1], addr_width, data_width, dtype)
-        spec_data = cd.scale_and_dBFS_specdata(spec_data, acc_len, dBFS)
-        lines[3].set_data(uncombined_freqs, spec_data[:combined_bin])
-        lines[4].set_data(combined_freqs, spec_data[combined_bin:])
+        lines[3].set_data(uncombined_freqs, band2[:combined_bin])
+        lines[4].set_data(combined_freqs, band2[combined_bin:])
 
         return lines
 
@@ -1,3 +1,5 @@
+import time
+import argparse
 import tomli
 import numpy as np
 import casperfpga
@@ -6,40 +8,58 @@ import sys
 sys.path.append("../..")
 import calandigital as cd
 
-N = 1000
-
-with open("invert_test2.toml", "rb") as f:
-    config = tomli.load(f)
-rfsoc = casperfpga.CasperFpga(config["IP"])
-
-spec_brams   = config["spectra"]["bram_names"]
-corr_brams   = config["corr"]["bram_names"]
-addr_width   = config["spectra"]["addr_width"]
-data_width   = config["spectra"]["data_width"]
-dtype_spec   = ">u" + str(data_width//8)
-dtype_corr   = ">i" + str(data_width//8)
-
-spec_0_data_list = []
-spec_1_data_list = []
-spec_2_data_list = []
-corr_r_data_list = []
-corr_i_data_list = []
-
-for _ in range(N):
-    spec_0_data = cd.read_interleave_data(rfsoc, spec_brams[0], addr_width, data_width, dtype_spec)
-    spec_1_data = cd.read_interleave_data(rfsoc, spec_brams[1], addr_width, data_width, dtype_spec)
-    spec_2_data = cd.read_interleave_data(rfsoc, spec_brams[2], addr_width, data_width, dtype_spec)
-    corr_r_data = cd.read_interleave_data(rfsoc, corr_brams[0], addr_width, data_width, dtype_corr)
-    corr_i_data = cd.read_interleave_data(rfsoc, corr_brams[1], addr_width, data_width, dtype_corr)
-    spec_0_data_list.append(spec_0_data)
-    spec_1_data_list.append(spec_1_data)
-    spec_2_data_list.append(spec_2_data)
-    corr_r_data_list.append(corr_r_data)
-    corr_i_data_list.append(corr_i_data)
-
-np.savez("invert_test2.npz",
-    spec_0=spec_0_data_list,
-    spec_1=spec_1_data_list,
-    spec_2=spec_2_data_list,
-    corr_r=corr_r_data_list,
-    corr_i=corr_i_data_list)
+parser = argparse.ArgumentParser(description="Record spectra and correlations of the invert_test2 model into memory mapped store files.")
+parser.add_argument("-c", "--config_file", default="invert_test2.toml",
+    help="TOLM configuration file for script.")
+parser.add_argument("-n", "--nframes", type=int, default=1000,
+    help="number of frames to record, 0 to record until interrupted.")
+parser.add_argument("-p", "--prefix", default="invert_test2",
+    help="prefix of the recording files (<prefix>_00000.cds, ...).")
+parser.add_argument("-f", "--frames_per_file", type=int, default=1000,
+    help="number of frames of each recording file.")
+parser.add_argument("-m", "--max_files", type=int, default=None,
+    help="keep only the last max_files recording files.")
+
+def main():
+    args = parser.parse_args()
+    with open(args.config_file, "rb") as f:
+        config = tomli.load(f)
+    rfsoc = casperfpga.CasperFpga(config["IP"])
+
+    spec_brams   = config["spectra"]["bram_names"]
+    corr_brams   = config["corr"]["bram_names"]
+    addr_width   = config["spectra"]["addr_width"]
+    data_width   = config["spectra"]["data_width"]
+    dtype_spec   = ">u" + str(data_width//8)
+    dtype_corr   = ">i" + str(data_width//8)
+    n_bins       = 2**addr_width * len(spec_brams[0])
+
+    # read all brams of a frame in planned bulk reads
+    regmap = cd.get_register_map(config["bitfile"])
+    plan   = cd.plan_bram_reads(regmap, sum(spec_brams + corr_brams, []),
+        2**addr_width*data_width//8)
+
+    # frames are recorded in the native integer type of the brams
+    spec_frame = np.empty((len(spec_brams), n_bins), np.dtype(dtype_spec).newbyteorder("="))
+    corr_frame = np.empty((len(corr_brams), n_bins), np.dtype(dtype_corr).newbyteorder("="))
+    fields = {"spec_" + str(i): (n_bins, spec_frame.dtype) for i in range(len(spec_brams))}
+    fields.update({"corr_r": (n_bins, corr_frame.dtype), "corr_i": (n_bins, corr_frame.dtype)})
+    recorder = cd.SpectraRecorder(args.prefix, fields, args.frames_per_file,
+        args.max_files, {"config": config})
+
+    print("Recording frames into " + args.prefix + "_*.cds (Ctrl+C to stop)...")
+    try:
+        while args.nframes == 0 or recorder.count < args.nframes:
+            cd.read_interleave_data_list(rfsoc, spec_brams + corr_brams, addr_width, data_width,
+                [dtype_spec]*len(spec_brams) + [dtype_corr]*len(corr_brams), plan,
+                list(spec_frame) + list(corr_frame))
+            frame = {"spec_" + str(i): spec_data for i, spec_data in enumerate(spec_frame)}
+            recorder.append(time.time(), corr_r=corr_frame[0], corr_i=corr_frame[1], **frame)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+    print("done, " + str(recorder.count) + " frames recorded")
+
+if __name__ == "__main__":
+    main()
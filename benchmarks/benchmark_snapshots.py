@@ -0,0 +1,81 @@
+# Benchmark of snapshot data decoding. Compares the per-word Python decoding
+# used previously in calandigital.read_snapshots against the vectorized
+# decode_snapshot_data. No RFSoC is required, the raw bram data is random.
+
+# imports
+import time
+import argparse
+import numpy as np
+
+import sys
+sys.path.append("..")
+import calandigital as cd
+
+parser = argparse.ArgumentParser(description="Benchmark snapshot decoding.")
+parser.add_argument("-n", "--nsnapshots", type=int, default=4,
+    help="number of snapshots decoded per frame.")
+parser.add_argument("-s", "--nsamples", type=int, default=2**16,
+    help="number of 16-bit samples per snapshot.")
+parser.add_argument("-r", "--repeat", type=int, default=10,
+    help="number of frames to time.")
+
+def main():
+    args = parser.parse_args()
+    word_bytes = 16
+    nbytes = args.nsamples * 2
+
+    # random raw bram data for every snapshot
+    rng = np.random.default_rng(0)
+    rawdata_list = [rng.integers(0, 256, nbytes, dtype=np.uint8).tobytes()
+        for _ in range(args.nsnapshots)]
+    # packed words as returned by casperfpga snapshot.read()
+    packed_list = [unpack_words(rawdata, word_bytes) for rawdata in rawdata_list]
+
+    # check both paths give the same samples
+    for rawdata, packed in zip(rawdata_list, packed_list):
+        assert np.array_equal(legacy_decode(packed),
+            cd.decode_snapshot_data(rawdata, word_bytes))
+
+    legacy_time = time_frames(lambda: [legacy_decode(packed)
+        for packed in packed_list], args.repeat)
+    unpack_time = time_frames(lambda: [unpack_words(rawdata, word_bytes)
+        for rawdata in rawdata_list], args.repeat)
+    vector_time = time_frames(lambda: [cd.decode_snapshot_data(rawdata, word_bytes)
+        for rawdata in rawdata_list], args.repeat)
+
+    print("Snapshots per frame:", args.nsnapshots,
+        "Samples per snapshot:", args.nsamples)
+    print("Legacy decode (to_bytes loop):     %.3f [ms/frame]" % (1e3*legacy_time))
+    print("Legacy decode + casperfpga unpack: %.3f [ms/frame]" % (1e3*(legacy_time+unpack_time)))
+    print("Vectorized decode:                 %.3f [ms/frame]" % (1e3*vector_time))
+    print("Speedup (decode only):             %.1fx" % (legacy_time/vector_time))
+    print("Speedup (with unpack):             %.1fx" % ((legacy_time+unpack_time)/vector_time))
+
+def unpack_words(rawdata, word_bytes):
+    """
+    Unpacks raw bram data into signed Python integers, one per word, the
+    same way casperfpga does for the snapshot 'd' field.
+    """
+    return [int.from_bytes(rawdata[i:i+word_bytes], "big", signed=True)
+        for i in range(0, len(rawdata), word_bytes)]
+
+def legacy_decode(data_packed):
+    """
+    Previous read_snapshots decoding of packed snapshot words.
+    """
+    data_bytes = b"".join([d.to_bytes(16, "little", signed=True) for d in data_packed])
+    return np.frombuffer(data_bytes, np.int16)
+
+def time_frames(func, repeat):
+    """
+    Returns the best time of several calls to func.
+    """
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+# Benchmark suite of the calandigital hot paths and of whole simulated
+# experiment runs (DSS calibration sweep and multiband hot/cold capture).
+# No RFSoC is required, the brams are backed by the simulated RFSoC. Results
+# can be saved as JSON and compared against a previous run to detect
+# performance regressions between commits.
+#
+# Examples:
+#   python benchmark_suite.py --save                 # run and save results
+#   python benchmark_suite.py --compare results/<commit>.json
+#   python benchmark_suite.py -k dBFS -k fixed       # run only some benchmarks
+
+# imports
+import os
+import re
+import time
+import json
+import tomllib
+import argparse
+import platform
+import tempfile
+import importlib
+import contextlib
+import subprocess
+import numpy as np
+import matplotlib
+matplotlib.use("Agg") # the experiment scripts plot while running
+import matplotlib.pyplot as plt
+
+import sys
+sys.path.append("..")
+import calandigital as cd
+
+parser = argparse.ArgumentParser(description="Benchmark calandigital hot paths and simulated experiments.")
+parser.add_argument("-k", "--keyword", action="append", default=[],
+    help="run only the benchmarks whose name contains this keyword (can be repeated).")
+parser.add_argument("-r", "--rounds", type=int, default=20,
+    help="number of timed rounds of the fast benchmarks.")
+parser.add_argument("--latency", type=float, default=0.0,
+    help="simulated latency of each rfsoc transaction (in seconds).")
+parser.add_argument("--throughput", type=float, default=None,
+    help="simulated rfsoc transfer speed (in bytes/s).")
+parser.add_argument("--save", action="store_true",
+    help="save the results in results/<git commit>.json.")
+parser.add_argument("--compare",
+    help="JSON results file of a previous run to compare against.")
+parser.add_argument("--threshold", type=float, default=1.2,
+    help="slowdown ratio (of the median) reported as regression.")
+
+# paths relative to this script
+bench_dir   = os.path.dirname(os.path.abspath(__file__))
+dss_dir     = bench_dir + "/../Digital-Sideband-Separation/bitfiles/"
+mbr_dir     = bench_dir + "/../Multiband-Receiver/MBR_experiment/"
+results_dir = bench_dir + "/results"
+
+# real sizes of the spectrometer models
+addr_width = 9
+data_width = 64
+n_brams    = 4
+n_bins     = 2**addr_width * n_brams
+
+benchmarks = []
+cleanups   = [] # functions called after running a benchmark
+def benchmark(rounds=None):
+    """
+    Decorator to register a benchmark. The decorated function gets the
+    parsed arguments and returns the function to time.
+    :param rounds: fixed number of rounds, for slow benchmarks.
+    """
+    def register(setup):
+        benchmarks.append((setup.__name__.removeprefix("bench_"), setup, rounds))
+        return setup
+    return register
+
+def main():
+    args = parser.parse_args()
+
+    results = {}
+    for name, setup, rounds in benchmarks:
+        if args.keyword and not any(keyword in name for keyword in args.keyword):
+            continue
+        try:
+            func = setup(args)
+            print("Running " + name + "...", end="", flush=True)
+            results[name] = time_rounds(func, rounds or args.rounds)
+            print("done")
+        finally:
+            while cleanups:
+                cleanups.pop()()
+
+    print_results(results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+        compare_results(results, reference["results"], args.threshold)
+
+    if args.save:
+        commit = get_commit()
+        os.makedirs(results_dir, exist_ok=True)
+        filename = results_dir + "/" + commit + ".json"
+        with open(filename, "w") as f:
+            json.dump({"commit": commit, "datetime": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "machine": platform.platform(), "python": platform.python_version(),
+                "numpy": np.__version__, "latency": args.latency,
+                "throughput": args.throughput, "results": results}, f, indent=4)
+        print("Results saved in " + filename)
+
+def time_rounds(func, rounds):
+    """
+    Time several rounds of a function, after a warm-up call.
+    :param func: function to time.
+    :param rounds: number of timed rounds.
+    :return: dictionary with the time stats (in seconds).
+    """
+    func()
+    times = []
+    for _ in range(rounds):
+        start_time = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start_time)
+    return {"rounds": rounds, "min": min(times), "max": max(times),
+        "mean": float(np.mean(times)), "median": float(np.median(times)),
+        "stddev": float(np.std(times))}
+
+def print_results(results):
+    """
+    Print the stats of every benchmark.
+    """
+    print("%-28s %10s %10s %10s %10s %6s" %
+        ("Benchmark", "min [ms]", "median", "mean", "stddev", "rounds"))
+    for name, stats in results.items():
+        print("%-28s %10.3f %10.3f %10.3f %10.3f %6d" % (name, 1e3*stats["min"],
+            1e3*stats["median"], 1e3*stats["mean"], 1e3*stats["stddev"], stats["rounds"]))
+
+def compare_results(results, reference, threshold):
+    """
+    Print the ratio of the median times against reference results, marking
+    the benchmarks slower than threshold.
+    """
+    print("%-28s %12s %12s %8s" % ("Benchmark", "ref [ms]", "now [ms]", "ratio"))
+    for name, stats in results.items():
+        if name not in reference:
+            continue
+        ratio = stats["median"] / reference[name]["median"]
+        mark  = "  REGRESSION" if ratio > threshold else ""
+        print("%-28s %12.3f %12.3f %8.2f%s" % (name, 1e3*reference[name]["median"],
+            1e3*stats["median"], ratio, mark))
+
+def get_commit():
+    """
+    Get the short hash of the current git commit, or "local" if not in git.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=bench_dir,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "local"
+
+def load_config(config_dir, config_file, simulation={}):
+    """
+    Load a script config, with the bitfile path relative to this script and
+    the simulated rfsoc options.
+    """
+    with open(config_dir + config_file, "rb") as f:
+        config = tomllib.load(f)
+    config["bitfile"] = config_dir + config["bitfile"]
+    config["simulate"] = True
+    config["program"]  = False
+    config["simulation"] = dict(simulation)
+    return config
+
+def sim_rfsoc(config, args, acc_time=1e9):
+    """
+    Create a simulated rfsoc. By default the accumulation time is long so that
+    spectra are synthesized only once.
+    """
+    config["simulation"].update({"latency": args.latency,
+        "throughput": args.throughput, "acc_time": acc_time, "seed": 0})
+    return cd.initialize_sim_rfsoc(config)
+
+def make_tmpdir():
+    """
+    Make a temporary directory, removed after the benchmark.
+    """
+    tmpdir = tempfile.TemporaryDirectory()
+    cleanups.append(tmpdir.cleanup)
+    return tmpdir.name
+
+def write_sim_config(config_dir, config_file, tmpdir, simulation, bitfile=None):
+    """
+    Write a copy of a script config into tmpdir, set to simulate the rfsoc
+    with the simulation options, as scripts read their config from the
+    working directory.
+    :param bitfile: bitfile of the copy, by default the one of the original
+        config.
+    """
+    with open(config_dir + config_file) as f:
+        config = f.read()
+    if bitfile is None:
+        bitfile = config_dir + re.search(r'(?m)^bitfile *= *"(.*)"', config).group(1)
+    config = re.sub(r'(?m)^bitfile *=.*$', 'bitfile = "' + bitfile + '"', config)
+    config = re.sub(r'(?m)^program *=.*$', 'program = false', config)
+    config = "simulate = true\n" + config + "\n[simulation]\n"
+    config += "".join(key + " = " + json.dumps(value) + "\n"
+        for key, value in simulation.items() if value is not None)
+    with open(tmpdir + "/" + config_file, "w") as f:
+        f.write(config)
+
+def import_scripts(script_dir, scripts, workdir):
+    """
+    Import experiment scripts from script_dir, with workdir as working
+    directory. The scripts are unloaded after the benchmark, as scripts of
+    different experiments share module names.
+    """
+    sys.path.insert(0, script_dir)
+    def unload():
+        sys.path.remove(script_dir)
+        for name in list(sys.modules):
+            if getattr(sys.modules[name], "__file__", None) and \
+                os.path.dirname(os.path.abspath(sys.modules[name].__file__)) == \
+                os.path.abspath(script_dir):
+                del sys.modules[name]
+    cleanups.append(unload)
+    with contextlib.chdir(workdir):
+        return [importlib.import_module(script) for script in scripts]
+
+@contextlib.contextmanager
+def run_script(workdir):
+    """
+    Context to run an experiment script in workdir, without its output.
+    """
+    with contextlib.chdir(workdir), open(os.devnull, "w") as devnull, \
+        contextlib.redirect_stdout(devnull):
+        yield
+    plt.close("all")
+
+def write_mbr_regmap(config, fpgfile):
+    """
+    Write an .fpg with only the register map of the multiband model (the
+    multiband .fpg is not in the repository).
+    """
+    devices = sum(config["spectra"]["bram_names"], []) + config["multiband"]["comb_brams"]
+    for section in ["dss1", "dss2"]:
+        devices += sum(config[section]["corr_brams"] + config[section]["synth_brams"] +
+            sum(config[section]["const_brams"], []), [])
+    with open(fpgfile, "w") as f:
+        for i, device in enumerate(devices):
+            f.write("?register\t%s\t0x%x\t0x1000\n" % (device, 0xa0000000 + i*0x1000))
+        for i, reg in enumerate([config["spectra"]["acc_reg"], config["spectra"]["reset_reg"]]):
+            f.write("?register\t%s\t0x%x\t0x4\n" % (reg, 0xa1000000 + 4*i))
+        f.write("?quit\n")
+
+class SnapshotsRFSoC():
+    """
+    RFSoC with snapshots that return fixed raw data, to time only the
+    read_snapshots overhead and decoding.
+    """
+    class Snapshot():
+        width_bits = 128
+        def __init__(self, rawdata):
+            self.rawdata = rawdata
+        def arm(self):
+            pass
+        def read_raw(self, arm=True):
+            return {"data": self.rawdata}, None
+
+    def __init__(self, snapnames, nbytes):
+        rng = np.random.default_rng(0)
+        self.snapshots = {snapname + "_ss": self.Snapshot(
+            rng.integers(0, 256, nbytes, dtype=np.uint8).tobytes())
+            for snapname in snapnames}
+
+@benchmark()
+def bench_read_snapshots(args):
+    snapnames = ["adc_snapshot0", "adc_snapshot1"]
+    rfsoc = SnapshotsRFSoC(snapnames, 2**18)
+    return lambda: cd.read_snapshots(rfsoc, snapnames)
+
+@benchmark()
+def bench_read_snapshots_sim(args):
+    # snapshots of the simulated model, all armed and then read one by one
+    config = load_config(dss_dir, "dss_2in_2048ch_983mhz_real.toml")
+    rfsoc  = sim_rfsoc(config, args)
+    snapnames = config["snapshots"]["snap_names"]
+    return lambda: cd.read_snapshots(rfsoc, snapnames)
+
+@benchmark()
+def bench_read_snapshots_planned(args):
+    # snapshots of the simulated model, all armed and then read in bulk
+    config = load_config(dss_dir, "dss_2in_2048ch_983mhz_real.toml")
+    rfsoc  = sim_rfsoc(config, args)
+    snapnames = config["snapshots"]["snap_names"]
+    plan   = cd.plan_snapshot_reads(rfsoc.regmap, snapnames)
+    return lambda: cd.read_snapshots(rfsoc, snapnames, plan)
+
+@benchmark()
+def bench_read_interleave_data(args):
+    config = load_config(dss_dir, "dss_2in_2048ch_983mhz_real.toml")
+    rfsoc  = sim_rfsoc(config, args)
+    brams  = config["spectra"]["bram_names"][0]
+    return lambda: cd.read_interleave_data(rfsoc, brams, addr_width, data_width, ">u8")
+
+@benchmark()
+def bench_read_interleave_list(args):
+    # all the brams read in a calibration step, with merged reads
+    config = load_config(dss_dir, "dss_2in_2048ch_983mhz_real.toml")
+    rfsoc  = sim_rfsoc(config, args)
+    brams_list = config["spectra"]["bram_names"] + config["dss"]["corr_brams"]
+    dtypes = [">u8", ">u8", ">i8", ">i8"]
+    plan   = cd.plan_bram_reads(rfsoc.regmap, sum(brams_list, []), 2**addr_width*data_width//8)
+    frame  = np.empty((len(brams_list), n_bins))
+    return lambda: cd.read_interleave_data_list(rfsoc, brams_list, addr_width,
+        data_width, dtypes, plan, frame)
+
+@benchmark()
+def bench_write_interleaved_data(args):
+    config = load_config(dss_dir, "dss_2in_2048ch_983mhz_real.toml")
+    rfsoc  = sim_rfsoc(config, args)
+    brams  = config["spectra"]["bram_names"][0]
+    data   = np.arange(n_bins, dtype=">u8")
+    return lambda: cd.write_interleaved_data(rfsoc, brams, data)
+
+@benchmark()
+def bench_scale_and_dBFS(args):
+    data = np.random.default_rng(0).integers(1, 2**40, n_bins).astype(">u8")
+    return lambda: cd.scale_and_dBFS_specdata(data, 1000, 86)
+
+@benchmark()
+def bench_scale_and_dBFS_frame(args):
+    # frame of 16 spectra converted in place, as in plot_spectra
+    data  = np.random.default_rng(0).integers(1, 2**40, (16, n_bins)).astype(float)
+    frame = np.empty_like(data)
+    def run():
+        frame[...] = data
+        cd.scale_and_dBFS_specdata(frame, 1000, 86, out=frame)
+    return run
+
+@benchmark()
+def bench_welch_spectra(args):
+    # spectra of 16 snapshots of 8192 samples, as in plot_snapshots
+    data = np.random.default_rng(0).integers(-2**15, 2**15, (16, 8192)).astype(np.int16)
+    return lambda: cd.compute_welch_spectra(data, 256)
+
+@benchmark()
+def bench_float2fixed(args):
+    consts = np.exp(1j*np.linspace(0, 2*np.pi, n_bins))
+    return lambda: [cd.float2fixed(consts.real, 32, 27), cd.float2fixed(consts.imag, 32, 27)]
+
+@benchmark()
+def bench_encode_fixed(args):
+    consts = np.exp(1j*np.linspace(0, 2*np.pi, n_bins))
+    return lambda: cd.encode_fixed(consts, 32, 27, nbrams=n_brams)
+
+@benchmark(rounds=3)
+def bench_dss_calibration_sweep(args):
+    # dss_calibrate.py with the default config (bin_step test bins, full
+    # spectra every spec_step bins), then loading the constants with
+    # dss_load_constants.py, with simulated rfsoc and RF generator
+    tmpdir = make_tmpdir()
+    acc_time = 1e-3
+    write_sim_config(dss_dir, "dss_2in_2048ch_983mhz_real.toml", tmpdir,
+        {"latency": args.latency, "throughput": args.throughput, "acc_time": acc_time,
+        "seed": 0, "gains": [1.0, 1.05], "phases": [0.0, 3.0]})
+    dss_common, dss_calibrate, dss_load_constants = import_scripts(dss_dir,
+        ["dss_common", "dss_calibrate", "dss_load_constants"], tmpdir)
+
+    def run():
+        with run_script(tmpdir):
+            dss_calibrate.main([])
+            dss_load_constants.dss_load_constants(dss_common.rfsoc, False, 0-1j,
+                dss_common.cal_tar)
+        check_srr()
+
+    def check_srr():
+        # a tone in each sideband at the middle of the band must come out
+        # stronger in the output of its sideband, by more than the ~29 dB SRR
+        # of the simulated imbalance without calibration (constants loaded in
+        # the wrong brams give ~23 dB)
+        test_bin = n_bins//2 + 1
+        dss_common.rf_generator.write("outp on")
+        for tone_sideband, rf_freqs in [("usb", dss_common.rf_freqs_usb), 
+            ("lsb", dss_common.rf_freqs_lsb)]:
+            dss_common.rf_generator.query("freq " + str(rf_freqs[test_bin]) + " ghz; *opc?")
+            cd.settle_accumulations(dss_common.rfsoc, acc_time, 
+                watch_bram=dss_common.bram_usb[0])
+            powers = dict(zip(["usb", "lsb"], cd.read_interleave_bins(dss_common.rfsoc, 
+                [dss_common.bram_usb, dss_common.bram_lsb], [test_bin], data_width, ">u8")))
+            other_sideband = "lsb" if tone_sideband == "usb" else "usb"
+            srr = 10*np.log10(powers[tone_sideband][0] / powers[other_sideband][0])
+            if srr < 40:
+                raise RuntimeError("Calibration failed, SRR of the " + tone_sideband +
+                    " tone is " + str(srr) + " dB.")
+        dss_common.rf_generator.write("outp off")
+    return run
+
+@benchmark(rounds=5)
+def bench_multiband_hotcold(args):
+    # cold and hot captures of all the multiband spectra, with noise
+    # temperature computation, saving and plotting by multiband_save_hotcold.py
+    tmpdir = make_tmpdir()
+    acc_time = 1e-3
+    config = load_config(mbr_dir, "mbr_config.toml")
+    write_mbr_regmap(config, tmpdir + "/mbr.fpg")
+    write_sim_config(mbr_dir, "mbr_config.toml", tmpdir,
+        {"latency": args.latency, "throughput": args.throughput, "acc_time": acc_time,
+        "seed": 0}, bitfile=tmpdir + "/mbr.fpg")
+    multiband_save_hotcold, = import_scripts(mbr_dir, ["multiband_save_hotcold"], tmpdir)
+    watch_bram = config["dss1"]["synth_brams"][0][0]
+
+    def set_load(load, rfsoc):
+        # the hot load has three times the noise power of the cold load
+        rfsoc.set_inputs(noise={"cold": 1e-6, "hot": 3e-6}[load], gains=rfsoc.gains,
+            phases=rfsoc.phases)
+        cd.settle_accumulations(rfsoc, acc_time, watch_bram=watch_bram)
+
+    def run():
+        with run_script(tmpdir):
+            multiband_save_hotcold.main(set_load)
+    return run
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,34 @@
 # imports
+import os
+import sys
+import json
+import re
 import time
+import zlib
+import atexit
+import hashlib
+import functools
+import queue
+import collections
 import warnings
+import struct
+import socket
+import threading
+import socketserver
+import concurrent.futures
+from multiprocessing import shared_memory, resource_tracker
 import numpy as np
 import casperfpga
+from casperfpga.transport_katcp import KatcpRequestFail
 
 def initialize_rfsoc(config):
-    rfsoc = casperfpga.CasperFpga(config["IP"])
-    # program rfsoc if in config or it has no program
-    if config["program"] or not rfsoc.is_running():
+    if config.get("simulate"):
+        rfsoc = initialize_sim_rfsoc(config)
+    else:
+        rfsoc = casperfpga.CasperFpga(config["IP"])
+    # program rfsoc if in config or it has no program (the simulated rfsoc
+    # has no program or RFDC to initialize)
+    if not config.get("simulate") and (config["program"] or not rfsoc.is_running()):
         rfsoc.upload_to_ram_and_program(config["bitfile"])
         time.sleep(0.1)
         rfdc = rfsoc.adcs["rfdc"]
@@ -18,26 +39,116 @@ def initialize_rfsoc(config):
         time.sleep(0.1)
         print("RFDC Status:")
         rfdc.status()
+    # record rfsoc traffic if a stats file is given
+    if config.get("rfsoc_stats"):
+        rfsoc = InstrumentedRFSoC(rfsoc)
+        atexit.register(rfsoc.dump_stats, config["rfsoc_stats"])
+        atexit.register(rfsoc.print_stats)
     return rfsoc
 
-def read_snapshots(rfsoc, snapnames):
-    data_list = []
-    # iterate for each snapshot
-    for snapname in snapnames:
-        # get snapshot object
-        snapshot = rfsoc.snapshots[snapname+"_ss"]
-        # get packed data
+def initialize_sim_rfsoc(config):
+    """
+    Create a simulated RFSoC from the bitfile and the [simulation] section of
+    the config (keys latency, throughput, acc_time, seed, and the inputs 
+    tones, noise, gains and phases, see SimRFSoC.set_inputs()).
+    :param config: config dictionary of the script.
+    :return: SimRFSoC object.
+    """
+    sim_config = dict(config.get("simulation", {}))
+    inputs = {key: sim_config.pop(key) for key in ["tones", "noise", "gains", "phases"]
+        if key in sim_config}
+    rfsoc = SimRFSoC(config["bitfile"], config, **sim_config)
+    rfsoc.set_inputs(**inputs)
+    return rfsoc
+
+def read_snapshots(rfsoc, snapnames, plan=None):
+    """
+    Reads data from a list of snapshot blocks in rfsoc. All the snapshots
+    are armed before any of them is read, so that their captures are
+    time-aligned (up to the arm latency) for cross-channel analysis. If a
+    read plan of the snapshot brams is given (see plan_snapshot_reads()),
+    the captures are drained with bulk reads, adjacent brams in a single
+    read, instead of one read_raw() per snapshot.
+    :param rfsoc: CasperFpga object to communicate with RFSoC.
+    :param snapnames: list of snapshot names (without the _ss suffix).
+    :param plan: read plan of the snapshot brams. If None, each snapshot is
+        read with read_raw().
+    :return: list of arrays with the samples of each snapshot.
+    """
+    # get snapshot objects
+    snapshots = [rfsoc.snapshots[snapname+"_ss"] for snapname in snapnames]
+    # arm all the snapshots first
+    for snapshot in snapshots:
         snapshot.arm()
-        data_packed = snapshot.read(arm=False)["data"]["d"]
-        # convert data into bytes
-        data_bytes = b"".join([d.to_bytes(16, "little", signed=True) for d in data_packed])
-        # convert data to correct type
-        data = np.frombuffer(data_bytes, np.int16)
-        # add to list of data
-        data_list.append(data)
-    return data_list
+    # drain the captures of <snapname>_ss_bram
+    if plan is None:
+        rawdata_list = [snapshot.read_raw(arm=False)[0]["data"] for snapshot in snapshots]
+    else:
+        wait_snapshots(rfsoc, snapnames)
+        rawdata_dict = read_planned_brams(rfsoc, plan)
+        rawdata_list = [rawdata_dict[snapname+"_ss_bram"] for snapname in snapnames]
+    # convert data to correct type
+    return [decode_snapshot_data(rawdata, snapshot.width_bits//8) 
+        for rawdata, snapshot in zip(rawdata_list, snapshots)]
+
+def plan_snapshot_reads(regmap, snapnames):
+    """
+    Makes a plan to read the brams of a list of snapshot blocks with the
+    least number of reads (see plan_bram_reads()), for read_snapshots().
+    The whole brams are read, their size is taken from the register map.
+    :param regmap: register map of the model. See get_register_map().
+    :param snapnames: list of snapshot names (without the _ss suffix).
+    :return: read plan, or None if the brams are not in the register map or
+        have different sizes.
+    """
+    brams = [snapname + "_ss_bram" for snapname in snapnames]
+    if not all([bram in regmap for bram in brams]):
+        return None
+    sizes = set([regmap[bram][1] for bram in brams])
+    if len(sizes) > 1:
+        return None
+    return plan_bram_reads(regmap, brams, sizes.pop())
+
+def wait_snapshots(rfsoc, snapnames, timeout=1.0):
+    """
+    Waits until the captures of armed snapshot blocks are done, polling the
+    busy bit (bit 31) of their status registers.
+    :param rfsoc: CasperFpga object to communicate with RFSoC.
+    :param snapnames: list of snapshot names (without the _ss suffix).
+    :param timeout: maximum time to wait in seconds.
+    """
+    start_time = time.time()
+    pending = list(snapnames)
+    while True:
+        pending = [snapname for snapname in pending 
+            if rfsoc.read_int(snapname+"_ss_status") & 0x80000000]
+        if not pending:
+            return
+        if time.time() - start_time > timeout:
+            raise RuntimeError("Snapshot capture timed out: " + ", ".join(pending))
+
+def decode_snapshot_data(rawdata, word_bytes=16, dtype=np.int16):
+    """
+    Decodes the raw bytes of a snapshot bram into an array of samples.
+    Snapshot words are big-endian with the first sample in the least
+    significant bits, so the buffer is reinterpreted as big-endian samples
+    and the sample order is reversed inside every word. Everything but the
+    final conversion to native byte order is done with Numpy views.
+    :param rawdata: raw bytes read from the snapshot bram.
+    :param word_bytes: width of a snapshot word in bytes.
+    :param dtype: data type of each sample.
+    :return: array with the samples in native byte order.
+    """
+    dtype = np.dtype(dtype)
+    samples_per_word = word_bytes // dtype.itemsize
+    # reinterpret buffer as words of big-endian samples
+    data = np.frombuffer(rawdata, dtype.newbyteorder(">"))
+    data = data.reshape((-1, samples_per_word))[:, ::-1]
+    # single copy to native byte order
+    data = data.astype(dtype, order="C").reshape(-1)
+    return data
     
-def read_data(rfsoc, bram, awidth, dwidth, dtype):
+def read_data(rfsoc, bram, awidth, dwidth, dtype, out=None, out_dtype=float):
     """
     Reads data from a bram in rfsoc.
     :param rfsoc: CasperFpga object to communicate with RFSoC.
@@ -45,15 +156,23 @@ def read_data(rfsoc, bram, awidth, dwidth, dtype):
     :param awidth: width of bram address in bits.
     :param dwidth: width of bram data in bits.
     :param dtype: data type of data in bram.
+    :param out: optional preallocated array where to write the data. If
+        given, no new array is allocated and out_dtype is ignored.
+    :param out_dtype: data type of the returned array. If None, the data type
+        of the bram in native byte order is used.
     :return: array with the read data.
     """
     depth = 2**awidth
     rawdata  = rfsoc.read(bram, depth*dwidth//8, 0)
     bramdata = np.frombuffer(rawdata, dtype=dtype)
-    bramdata = bramdata.astype(float)
-    return bramdata
+    if out is None:
+        if out_dtype is None:
+            out_dtype = bramdata.dtype.newbyteorder("=")
+        out = np.empty(len(bramdata), dtype=out_dtype)
+    out[:] = bramdata
+    return out
 
-def read_interleave_data(rfsoc, brams, awidth, dwidth, dtype):
+def read_interleave_data(rfsoc, brams, awidth, dwidth, dtype, out=None, out_dtype=float):
     """
     Reads data from a list of brams and interleave the data.
     :param rfoc: CalanFpga object to communicate with RFSoC.
@@ -61,15 +180,198 @@ def read_interleave_data(rfsoc, brams, awidth, dwidth, dtype):
     :param awidth: width of bram address in bits.
     :param dwidth: width of bram data in bits.
     :param dtype: data type of data in brams. See read_snapshots().
+    :param out: optional preallocated array where to write the data. See
+        read_data().
+    :param out_dtype: data type of the returned array. See read_data().
     :return: array with the read data.
     """
     # get data
-    bramdata_list = [read_data(rfsoc, bram, awidth, dwidth, dtype) for bram in brams]
-    # interleave data list into a single array (this works, believe me)
-    interleaved_data = np.vstack(bramdata_list).reshape((-1,), order='F')
+    rawdata_list = [rfsoc.read(bram, 2**awidth*dwidth//8, 0) for bram in brams]
+    # interleave data list into a single array
+    interleaved_data = interleave_bramdata(rawdata_list, dtype, out, out_dtype)
     return interleaved_data
 
-def write_interleaved_data(rfsoc, brams, data):
+def read_interleave_data_list(rfsoc, brams_list, awidth, dwidth, dtype, plan=None,
+    out=None, out_dtype=float):
+    """
+    Reads data from several lists of brams and interleave the data of each
+    list. The brams are read following a read plan (see plan_bram_reads()),
+    so adjacent brams of every list are read in a single transaction.
+    :param rfsoc: CasperFpga object to communicate with RFSoC.
+    :param brams_list: list of lists of brams to read and interleave.
+    :param awidth: width of bram address in bits.
+    :param dwidth: width of bram data in bits.
+    :param dtype: data type of data in brams. It can be a single type for all
+        the lists or a list of types, one for each list of brams.
+    :param plan: read plan to use. If None, one read per bram is done.
+    :param out: optional preallocated arrays where to write the data, one for
+        each list of brams. A 2D array with one row per list can be used.
+    :param out_dtype: data type of the returned arrays. See read_data().
+    :return: list of arrays with the read data.
+    """
+    nbytes = 2**awidth * dwidth//8
+    if plan is None:
+        plan = plan_bram_reads({}, sum(brams_list, []), nbytes)
+    if isinstance(dtype, (str, type, np.dtype)):
+        dtype = [dtype] * len(brams_list)
+    if out is None:
+        out = [None] * len(brams_list)
+
+    # get data
+    rawdata_dict = read_planned_brams(rfsoc, plan)
+
+    # interleave data of each list of brams
+    interleaved_data_list = []
+    for brams, brams_dtype, brams_out in zip(brams_list, dtype, out):
+        rawdata_list = [rawdata_dict[bram] for bram in brams]
+        interleaved_data = interleave_bramdata(rawdata_list, brams_dtype, brams_out, out_dtype)
+        interleaved_data_list.append(interleaved_data)
+    return interleaved_data_list
+
+def interleave_bramdata(rawdata_list, dtype, out=None, out_dtype=float):
+    """
+    Interleaves the raw data of a list of brams into a single array. The
+    data of each bram is converted and written directly into a strided
+    slice of the output array, so no intermediate arrays are created.
+    :param rawdata_list: list of raw data (bytes) of each bram.
+    :param dtype: data type of data in brams.
+    :param out: optional preallocated array where to write the data. See
+        read_data().
+    :param out_dtype: data type of the returned array. See read_data().
+    :return: array with the interleaved data.
+    """
+    nbrams = len(rawdata_list)
+    if out is None:
+        dtype = np.dtype(dtype)
+        if out_dtype is None:
+            out_dtype = dtype.newbyteorder("=")
+        ndata = sum([len(rawdata) for rawdata in rawdata_list]) // dtype.itemsize
+        out = np.empty(ndata, dtype=out_dtype)
+    for i, rawdata in enumerate(rawdata_list):
+        out[i::nbrams] = np.frombuffer(rawdata, dtype=dtype)
+    return out
+
+def read_interleave_bins(rfsoc, brams_list, bins, dwidth, dtype, out_dtype=float):
+    """
+    Reads only some bins of interleaved data from several lists of brams.
+    Bin k of the interleaved data is in the bram k % nbrams at the address
+    k // nbrams, so only the words holding the selected bins are read.
+    :param rfsoc: CasperFpga object to communicate with RFSoC.
+    :param brams_list: list of lists of brams with interleaved data.
+    :param bins: list of bins (indexes of the interleaved data) to read.
+    :param dwidth: width of bram data in bits.
+    :param dtype: data type of data in brams. It can be a single type for all
+        the lists or a list of types, one for each list of brams.
+    :param out_dtype: data type of the returned arrays. See read_data().
+    :return: list of arrays with the data of the selected bins, one for
+        each list of brams.
+    """
+    nbytes = dwidth//8
+    if isinstance(dtype, (str, type, np.dtype)):
+        dtype = [dtype] * len(brams_list)
+
+    bindata_list = []
+    for brams, brams_dtype in zip(brams_list, dtype):
+        nbrams = len(brams)
+        rawdata = b"".join([rfsoc.read(brams[k % nbrams], nbytes, (k//nbrams)*nbytes)
+            for k in bins])
+        bindata = np.frombuffer(rawdata, dtype=brams_dtype)
+        if out_dtype is None:
+            bindata_list.append(bindata.astype(bindata.dtype.newbyteorder("=")))
+        else:
+            bindata_list.append(bindata.astype(out_dtype))
+    return bindata_list
+
+def get_register_map(fpgfile):
+    """
+    Gets the register map from the ?register lines of the header of an .fpg
+    file. If the file does not exist a warning is printed and an empty map
+    is returned, so that read plans fall back to one read per bram.
+    :param fpgfile: .fpg file of the model.
+    :return: dictionary with the (address, size) of each register.
+    """
+    regmap = {}
+    try:
+        f = open(fpgfile, "rb")
+    except FileNotFoundError:
+        warnings.warn("Could not find " + fpgfile + " to get register map.")
+        return regmap
+    with f:
+        for line in f:
+            # header ends at ?quit, after it comes the bitstream
+            if line.startswith(b"?quit"):
+                break
+            if line.startswith(b"?register"):
+                _, name, address, size = line.decode().split()
+                regmap[name] = (int(address, 16), int(size, 16))
+    return regmap
+
+def plan_bram_reads(regmap, brams, nbytes):
+    """
+    Makes a plan to read a list of brams with the least number of reads.
+    Brams that are contiguous in the address space of the register map are
+    merged into a single read, that starts from the first bram of the group.
+    Brams not in the register map are read individually.
+    :param regmap: register map of the model. See get_register_map().
+    :param brams: list of brams to read.
+    :param nbytes: number of bytes to read from each bram.
+    :return: read plan. List of reads, each read is a tuple with the device
+        name to read from, the number of bytes to read, and a list of
+        (bram, offset) pairs with the offset of each bram inside the read.
+    """
+    plan = []
+    mapped_brams = sorted([bram for bram in brams if bram in regmap],
+        key=lambda bram: regmap[bram][0])
+    unmapped_brams = [bram for bram in brams if bram not in regmap]
+
+    start_addr = None
+    for bram in mapped_brams:
+        address, size = regmap[bram]
+        # merge bram if it starts exactly where the last bram ends
+        if start_addr is not None and address == end_addr:
+            plan[-1][2].append((bram, address-start_addr))
+        else:
+            start_addr = address
+            plan.append([bram, 0, [(bram, 0)]])
+        plan[-1][1] = address - start_addr + nbytes
+        end_addr = address + size
+    plan = [tuple(read) for read in plan]
+
+    for bram in unmapped_brams:
+        plan.append((bram, nbytes, [(bram, 0)]))
+    return plan
+
+def read_planned_brams(rfsoc, plan):
+    """
+    Reads brams following a read plan. If the server rejects a merged read
+    (a katcp fail reply, for servers that do not allow reads that span
+    several devices), the brams of that read are read individually, and
+    the plan is updated so that the merged read is not tried again. Any
+    other error (timeouts, lost connections) is raised, and the plan is
+    left unchanged.
+    :param rfsoc: CasperFpga object to communicate with RFSoC.
+    :param plan: read plan. See plan_bram_reads().
+    :return: dictionary with a memoryview of the raw data of each bram.
+    """
+    rawdata_dict = {}
+    for device, nbytes, bram_offsets in list(plan):
+        bram_nbytes = nbytes - bram_offsets[-1][1]
+        try:
+            rawdata = memoryview(rfsoc.read(device, nbytes, 0))
+        except KatcpRequestFail:
+            if len(bram_offsets) == 1:
+                raise
+            # split the merged read into single bram reads
+            split_reads = [(bram, bram_nbytes, [(bram, 0)]) for bram, _ in bram_offsets]
+            plan.remove((device, nbytes, bram_offsets))
+            plan.extend(split_reads)
+            rawdata_dict.update(read_planned_brams(rfsoc, split_reads))
+            continue
+        for bram, offset in bram_offsets:
+            rawdata_dict[bram] = rawdata[offset:offset+bram_nbytes]
+    return rawdata_dict
+
+def write_interleaved_data(rfsoc, brams, data, shadow=None):
     """
     Deinterleaves an array of interleaved data, and writes each deinterleaved
     array into a bram of a list of brams.
@@ -77,34 +379,935 @@ def write_interleaved_data(rfsoc, brams, data):
     :param brams: list of brams to write into.
     :param data: array of data to write. (Every Numpy type is accepted but the
         data converted into bytes before is written).
+    :param shadow: shadow copy of the brams contents, see write_bram_data().
+    """
+    write_bram_data(rfsoc, deinterleave_data(brams, data), shadow)
+
+def deinterleave_data(brams, data):
+    """
+    Deinterleaves an array of interleaved data into the bytes to write into
+    each bram of a list of brams.
+    :param brams: list of brams.
+    :param data: array of data to deinterleave.
+    :return: dictionary with the bytes to write into each bram.
     """
     ndata  = len(data)
     nbrams = len(brams)
 
     # deinterleave data into arrays (this works, believe me)
     bramdata_list = np.transpose(np.reshape(data, (ndata//nbrams, nbrams)))
+
+    return {bram: bramdata.tobytes() for bram, bramdata in zip(brams, bramdata_list)}
+
+def write_bram_data(rfsoc, bram_data, shadow=None, merge_gap=64, regmap=None):
+    """
+    Writes raw data into brams. If a shadow copy of the brams is given, only
+    the byte ranges that differ from the shadow copy are written, and the
+    shadow copy is updated. Brams not in the shadow copy are read back once
+    before writing, all of them in a planned read (see plan_bram_reads()).
+    The shadow copy must be cleared if the RFSoC is reprogrammed.
+    :param rfsoc: CalanFpga object to communicate with RFSoC.
+    :param bram_data: dictionary with the data to write into each bram
+        (bytes or contiguous arrays).
+    :param shadow: dictionary with the last data written into each bram,
+        or None to always write the full brams.
+    :param merge_gap: changed ranges separated by merge_gap bytes or less
+        are merged in a single write.
+    :param regmap: register map of the model, to merge the read back of
+        contiguous brams. If None, each bram is read back individually.
+        See get_register_map().
+    :return: number of bytes written.
+    """
+    # raw views of the data, without copying it
+    bram_data = {bram: memoryview(data).cast("B") for bram, data in bram_data.items()}
+    if shadow is not None:
+        missing = [bram for bram in bram_data if bram not in shadow]
+        for size in set(len(bram_data[bram]) for bram in missing):
+            plan = plan_bram_reads(regmap or {}, 
+                [bram for bram in missing if len(bram_data[bram]) == size], size)
+            rawdata_dict = read_planned_brams(rfsoc, plan)
+            shadow.update({bram: bytes(rawdata) for bram, rawdata in rawdata_dict.items()})
+
+    nbytes = 0
+    for bram, data in bram_data.items():
+        if shadow is None:
+            ranges = [(0, len(data))]
+        else:
+            ranges = get_changed_ranges(shadow[bram], data, merge_gap)
+        for start, end in ranges:
+            rfsoc.write(bram, bytes(data[start:end]), start)
+            nbytes += end - start
+        if shadow is not None and ranges:
+            shadow[bram] = bytes(data)
+    return nbytes
+
+def get_changed_ranges(old_data, new_data, merge_gap=64, word_bytes=4):
+    """
+    Get the byte ranges that differ between two versions of the data of a
+    bram. Ranges are aligned to word_bytes, as required by casperfpga writes.
+    :param old_data: previous bram data (bytes).
+    :param new_data: new bram data (bytes).
+    :param merge_gap: changed ranges separated by merge_gap bytes or less
+        are merged in a single range.
+    :param word_bytes: alignment of the ranges in bytes.
+    :return: list of (start, end) byte ranges.
+    """
+    if len(old_data) != len(new_data):
+        return [(0, len(new_data))]
+
+    # changed words
+    old_data = np.frombuffer(old_data, np.uint8)
+    new_data = np.frombuffer(new_data, np.uint8)
+    words = np.unique(np.flatnonzero(old_data != new_data) // word_bytes)
+    if len(words) == 0:
+        return []
+
+    # merge words separated by less than merge_gap
+    splits = np.flatnonzero((np.diff(words) - 1) * word_bytes > merge_gap)
+    starts = words[np.r_[0, splits+1]] * word_bytes
+    ends   = np.minimum((words[np.r_[splits, -1]] + 1) * word_bytes, len(new_data))
+    return list(zip(starts.tolist(), ends.tolist()))
+
+def get_file_hash(filename, *params):
+    """
+    Computes a hash of the contents of a file and of a list of parameters,
+    to use as key of cached data computed from them.
+    :param filename: file to hash.
+    :param params: parameters to add to the hash.
+    :return: hash as hexadecimal string.
+    """
+    filehash = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            filehash.update(chunk)
+    filehash.update(repr(params).encode())
+    return filehash.hexdigest()
+
+def get_cached_bram_data(cache_dir, key, compute):
+    """
+    Gets the data to write into brams from a cache directory. If the key is
+    not in the cache, the data is computed and saved in the cache as an
+    uncompressed sweep store (cache_dir/key.cds).
+    :param cache_dir: cache directory.
+    :param key: key of the data, e.g. from get_file_hash().
+    :param compute: function with no arguments that returns a dictionary
+        with the bytes to write into each bram.
+    :return: dictionary with the data to write into each bram.
+    """
+    cache_file = cache_dir + "/" + key + ".cds"
+    if os.path.exists(cache_file):
+        return read_sweep_store(cache_file)
+
+    bram_data = compute()
+    os.makedirs(cache_dir, exist_ok=True)
+    arrays = {bram: np.frombuffer(data, np.uint8) for bram, data in bram_data.items()}
+    write_sweep_store(cache_file + ".tmp", arrays, compress=False)
+    os.replace(cache_file + ".tmp", cache_file)
+    return bram_data
+
+def plan_adaptive_bins(bins, values, tol, max_bins):
+    """
+    Plans the next test bins of an adaptive sweep. An interval between two
+    consecutive measured bins is refined (its middle bin is added) if the
+    values at its ends differ more than tol, or if one of its ends disagrees
+    more than tol with the linear interpolation of its neighbours. Intervals
+    are refined in decreasing order of error until the bin budget is used.
+    :param bins: list of measured bins.
+    :param values: list of measured values at each bin. Complex values are
+        accepted, so magnitude and phase are checked at the same time.
+    :param tol: tolerance relative to the magnitude of the values.
+    :param max_bins: maximum total number of test bins in the sweep.
+    :return: sorted list of new bins to measure. Empty if the sweep is done.
+    """
+    order  = np.argsort(bins)
+    bins   = np.asarray(bins)[order]
+    values = np.asarray(values)[order]
+    n_new  = max_bins - len(bins)
+    if len(bins) < 2 or n_new <= 0:
+        return []
+    magnitude = np.maximum(np.abs(values), np.finfo(float).tiny)
+
+    # change of the values along each interval
+    interval_err = np.abs(np.diff(values)) / np.maximum(magnitude[:-1], magnitude[1:])
     
-    # write data into brams
-    for bram, bramdata in zip(brams, bramdata_list):
-        rfsoc.write(bram, bramdata.tobytes(), 0)
+    # disagreement of every interior bin with the interpolation of its neighbours
+    weights = (bins[1:-1] - bins[:-2]) / (bins[2:] - bins[:-2])
+    interp  = values[:-2] + weights * (values[2:] - values[:-2])
+    point_err = np.abs(values[1:-1] - interp) / magnitude[1:-1]
+    interval_err[:-1] = np.maximum(interval_err[:-1], point_err)
+    interval_err[1:]  = np.maximum(interval_err[1:],  point_err)
+
+    # refine worst intervals that can still be split
+    widths = np.diff(bins)
+    refine = np.where((interval_err > tol) & (widths > 1))[0]
+    refine = refine[np.argsort(interval_err[refine])[::-1]][:n_new]
+    new_bins = bins[refine] + widths[refine]//2
+    return sorted(new_bins.tolist())
+
+def get_acc_time(n_bins, bandwidth, acclen):
+    """
+    Computes the time it takes a spectrometer to complete an accumulation.
+    :param n_bins: number of spectral channels of the spectrometer.
+    :param bandwidth: bandwidth of the spectrometer in MHz.
+    :param acclen: accumulation length of spectrometer.
+    :return: accumulation time in seconds.
+    """
+    return n_bins / (bandwidth*1e6) * acclen
+
+def wait_accumulations(rfsoc, acc_time, n_accs=2, count_reg=None, watch_bram=None,
+    watch_nbytes=64, timeout=None):
+    """
+    Waits until n_accs new accumulations are completed after the call. The
+    accumulations are detected by polling an accumulation counter register,
+    or if there is no counter, by watching the contents of a bram change.
+    If none of them is given, or they do not change before the timeout, the
+    function waits for the worst case time. Use n_accs=2 after changing the
+    input signal, because the accumulation running at the time of the call
+    has mixed data.
+    :param rfsoc: CasperFpga object to communicate with RFSoC.
+    :param acc_time: accumulation time in seconds. See get_acc_time().
+    :param n_accs: number of new accumulations to wait.
+    :param count_reg: accumulation counter register name.
+    :param watch_bram: bram to watch for changes if there is no counter.
+    :param watch_nbytes: number of bytes read from watch_bram in each poll.
+    :param timeout: maximum time to wait in seconds. If None, it is computed
+        as twice the worst case time plus 0.1 [s] for communication delays.
+    :return: True if the accumulations were detected, False otherwise.
+    """
+    start_time = time.time()
+    if timeout is None:
+        timeout = 2*n_accs*acc_time + 0.1
+
+    if count_reg is not None:
+        get_state = lambda: rfsoc.read_int(count_reg) & 0xffffffff
+    elif watch_bram is not None:
+        get_state = lambda: rfsoc.read(watch_bram, watch_nbytes, 0)
+    else:
+        time.sleep(n_accs*acc_time)
+        return False
+
+    # poll until the state changes n_accs times
+    start_state = last_state = get_state()
+    n_changes = 0
+    while time.time() - start_time < timeout:
+        time.sleep(acc_time/4)
+        state = get_state()
+        if count_reg is not None:
+            n_changes = (state - start_state) & 0xffffffff
+        elif state != last_state:
+            n_changes += 1
+            last_state = state
+        if n_changes >= n_accs:
+            return True
+    return False
+
+def settle_accumulations(rfsoc, acc_time, retries=0, strict=False, **kwargs):
+    """
+    Waits for new accumulations with wait_accumulations(), so that the
+    spectra read afterwards are not stale. If the new accumulations are
+    not detected (e.g. the watched bram does not change with a quiet input),
+    the wait already lasted the worst case time, so the data is considered
+    settled and only a warning is given, unless strict detection is asked.
+    If there is neither count_reg nor watch_bram, the worst case time is
+    waited without detection nor warning.
+    :param rfsoc: CasperFpga object to communicate with RFSoC.
+    :param acc_time: accumulation time in seconds. See get_acc_time().
+    :param retries: number of retries of the wait when the accumulations are
+        not detected.
+    :param strict: if True, raise an error if the accumulations are not
+        detected after the retries.
+    :param kwargs: other arguments of wait_accumulations().
+    :return: True if the accumulations were detected, False otherwise.
+    :raise RuntimeError: with strict, if the new accumulations are not
+        detected after the retries.
+    """
+    if kwargs.get("count_reg") is None and kwargs.get("watch_bram") is None:
+        wait_accumulations(rfsoc, acc_time, **kwargs)
+        return False
+    for retry in range(retries+1):
+        if wait_accumulations(rfsoc, acc_time, **kwargs):
+            return True
+        if retry < retries:
+            warnings.warn("New accumulations not detected, retrying (" + 
+                str(retry+1) + "/" + str(retries) + ").")
+    if strict:
+        raise RuntimeError("New accumulations not detected after " + str(retries) + 
+            " retries, the spectra could be stale.")
+    warnings.warn("New accumulations not detected before the timeout, continuing " + 
+        "after the worst case wait.")
+    return False
+
+def run_tone_sweep(steps, set_tone, settle, read, plot=None, save=None, queue_size=8):
+    """
+    Runs a pipelined tone sweep. The critical path of each step (set tone,
+    settle, read) runs in an acquisition thread, while saving runs in a
+    worker thread fed through a bounded queue, and plotting runs in the
+    calling thread (matplotlib is not thread safe) with the newest results
+    available, skipping steps if plotting is slower than acquisition.
+    :param steps: list of sweep steps (for example, test bins).
+    :param set_tone: function set_tone(step) that sets the test tone.
+    :param settle: function settle(step) that waits for the data to be ready.
+    :param read: function read(step) that reads and returns the step data.
+    :param plot: optional function plot(steps, results) with the steps done
+        and their results so far.
+    :param save: optional function save(step, data) to save the step data.
+    :param queue_size: maximum number of steps waiting to be saved. The
+        acquisition is paused if the save queue is full.
+    The first error of any stage stops the acquisition and is raised as 
+    soon as the current step ends, so that a failing save does not let the
+    sweep run without saving.
+    :return: list with the results of every step, and a dictionary with the
+        time spent in each step of each stage (see print_stage_times()).
+    """
+    steps = list(steps)
+    stages = ["set_tone", "settle", "read", "plot", "save"]
+    timing = {stage: [] for stage in stages}
+    results = []
+    errors = []
+    failed = threading.Event()
+    new_results = threading.Event()
+    save_queue = queue.Queue(queue_size)
+
+    def timed(stage, func, *args):
+        start_time = time.perf_counter()
+        ret = func(*args)
+        timing[stage].append(time.perf_counter() - start_time)
+        return ret
+
+    def acquire():
+        try:
+            for step in steps:
+                if failed.is_set():
+                    break
+                timed("set_tone", set_tone, step)
+                timed("settle", settle, step)
+                data = timed("read", read, step)
+                results.append(data)
+                new_results.set()
+                if save is not None:
+                    save_queue.put((step, data))
+        except Exception as e:
+            errors.append(e)
+            failed.set()
+        finally:
+            save_queue.put(None)
+            new_results.set()
+
+    def save_worker():
+        # keep consuming after an error so that acquisition never blocks
+        while (item := save_queue.get()) is not None:
+            if failed.is_set():
+                continue
+            try:
+                timed("save", save, *item)
+            except Exception as e:
+                errors.append(e)
+                failed.set()
+                new_results.set()
+
+    acq_thread  = threading.Thread(target=acquire, daemon=True)
+    save_thread = threading.Thread(target=save_worker, daemon=True)
+    acq_thread.start()
+    save_thread.start()
+
+    # plot newest results while acquiring
+    n_plotted = 0
+    while (acq_thread.is_alive() or n_plotted < len(results)) and not failed.is_set():
+        new_results.wait(0.1)
+        new_results.clear()
+        n_done = len(results)
+        if plot is not None and n_done > n_plotted and not errors:
+            try:
+                timed("plot", plot, steps[:n_done], results[:n_done])
+            except Exception as e:
+                errors.append(e)
+                failed.set()
+        n_plotted = n_done
+
+    acq_thread.join()
+    save_thread.join()
+    if errors:
+        raise errors[0]
+    return results, timing
+
+def print_stage_times(timing):
+    """
+    Prints the number of calls, mean time and total time of each stage of
+    a tone sweep.
+    :param timing: dictionary with the list of times of each stage, as
+        returned by run_tone_sweep().
+    """
+    for stage, times in timing.items():
+        if len(times) == 0:
+            continue
+        print("  %-8s: %4d calls, mean %8.2f [ms], total %7.2f [s]" % \
+            (stage, len(times), 1e3*np.mean(times), np.sum(times)))
+
+def open_checkpoint(checkpoint_file, resume):
+    """
+    Opens a sweep checkpoint file. The checkpoint has one line per measured
+    step with a JSON list [step, value0, value1, ...], so it can be appended
+    while measuring and survives crashes (unparsable lines, like an
+    incomplete last line, are skipped with a warning).
+    :param checkpoint_file: checkpoint file name.
+    :param resume: if True, get the steps already done from the checkpoint,
+        else remove any previous checkpoint to start a new one.
+    :return: dictionary with the list of values of each step already done.
+    """
+    checkpoint = {}
+    if not resume:
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+        return checkpoint
+    if not os.path.exists(checkpoint_file):
+        warnings.warn("No checkpoint " + checkpoint_file + " to resume from.")
+        return checkpoint
+    with open(checkpoint_file) as f:
+        lines = f.readlines()
+    nbad = 0
+    for line in lines:
+        try:
+            step, *values = json.loads(line)
+        except ValueError:
+            nbad += 1
+            continue
+        checkpoint[step] = values
+    if nbad > 0:
+        warnings.warn("Skipped " + str(nbad) + " unparsable lines of checkpoint " +
+            checkpoint_file + ", their steps will be measured again.")
+    return checkpoint
+
+def append_checkpoint(checkpoint_file, step, values):
+    """
+    Appends the values of a measured step to a sweep checkpoint file, and
+    flushes it to disk. If the file does not end with a newline (a partial
+    write before a crash), a newline is added first so that the new line is
+    not merged with it. See open_checkpoint().
+    :param checkpoint_file: checkpoint file name.
+    :param step: step measured (for example, a test bin).
+    :param values: list of values measured in the step.
+    """
+    with open(checkpoint_file, "a+b") as f:
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+        f.write((json.dumps([int(step)] + [float(value) for value in values]) + "\n").encode())
+        f.flush()
+        os.fsync(f.fileno())
+
+def create_sweep_store(filename, nrows, fields, metadata={}):
+    """
+    Creates a sweep store. A sweep store is a single file container with a
+    JSON header (metadata and array layout) followed by the arrays data.
+    The arrays of a new store are preallocated with shape (nrows, size) and
+    memory mapped, so rows can be appended while sweeping (see SweepStore).
+    A "steps" array records the step of each row (-1 for empty rows).
+    :param filename: store file name (.cds).
+    :param nrows: maximum number of rows (steps) of the store.
+    :param fields: dictionary with the (size, dtype) of the row of each array.
+        The size can be a tuple for multidimensional rows, () for scalars.
+    :param metadata: dictionary with metadata to save in the header.
+    :return: SweepStore object opened for appending.
+    """
+    arrays = {"steps": {"dtype": "<i8", "shape": [nrows]}}
+    for name, (size, dtype) in fields.items():
+        shape = [nrows] + (list(size) if isinstance(size, tuple) else [size])
+        arrays[name] = {"dtype": np.dtype(dtype).str, "shape": shape}
+    write_store_header(filename, arrays, metadata)
+    store = SweepStore(filename, "r+")
+    store["steps"][:] = -1
+    store.count = 0
+    return store
+
+def write_sweep_store(filename, arrays, metadata={}, compress=True, chunk_rows=16, nthreads=None):
+    """
+    Writes a dictionary of arrays into a sweep store. If compress is True
+    the arrays are split in chunks of chunk_rows rows (along the first axis),
+    that are compressed with zlib in parallel threads.
+    :param filename: store file name (.cds).
+    :param arrays: dictionary with the arrays to save.
+    :param metadata: dictionary with metadata to save in the header.
+    :param compress: if True compress the arrays, else save them uncompressed.
+    :param chunk_rows: number of rows of each compressed chunk.
+    :param nthreads: number of compression threads. If None use the number
+        of CPUs.
+    """
+    arrays = {name: np.asarray(data, order="C") for name, data in arrays.items()}
+    layout = {name: {"dtype": data.dtype.str, "shape": list(data.shape)} 
+        for name, data in arrays.items()}
+
+    if not compress:
+        write_store_header(filename, layout, metadata)
+        store = SweepStore(filename, "r+")
+        for name, data in arrays.items():
+            store[name][...] = data
+        store.close()
+        return
+
+    # compress chunks of every array in parallel
+    chunks = []
+    for name, data in arrays.items():
+        # explicit row size, so that arrays with no rows are also chunked
+        rows = data.reshape((len(data), int(np.prod(data.shape[1:])))) \
+            if data.ndim > 0 else data.reshape((1,1))
+        chunks += [(name, rows[i:i+chunk_rows]) for i in range(0, max(len(rows), 1), chunk_rows)]
+    with concurrent.futures.ThreadPoolExecutor(nthreads) as executor:
+        compressed = list(executor.map(lambda chunk: zlib.compress(chunk[1].tobytes()), chunks))
+
+    # compute chunks offsets from the end of the header
+    offset = 0
+    for name in layout:
+        layout[name]["chunk_rows"] = chunk_rows
+        layout[name]["chunks"] = []
+    for (name, _), chunk in zip(chunks, compressed):
+        layout[name]["chunks"].append([offset, len(chunk)])
+        offset += len(chunk)
+
+    header_nbytes = write_store_header(filename, layout, metadata, offset)
+    with open(filename, "r+b") as f:
+        f.seek(header_nbytes)
+        for chunk in compressed:
+            f.write(chunk)
+
+def read_sweep_store(filename, prefix="", nthreads=None):
+    """
+    Reads all the arrays of a sweep store whose names start with prefix.
+    Compressed arrays are decompressed in parallel threads.
+    :param filename: store file name (.cds).
+    :param prefix: prefix of the names of the arrays to read. The prefix is
+        removed from the names of the returned arrays.
+    :param nthreads: number of decompression threads. If None use the number
+        of CPUs.
+    :return: dictionary with the read arrays.
+    """
+    store = SweepStore(filename)
+    names = [name for name in store.fields if name.startswith(prefix)]
+    with concurrent.futures.ThreadPoolExecutor(nthreads) as executor:
+        arrays = list(executor.map(lambda name: np.array(store[name]), names))
+    store.close()
+    return {name[len(prefix):]: data for name, data in zip(names, arrays)}
+
+def write_store_header(filename, arrays, metadata, data_nbytes=None):
+    """
+    Writes the header of a sweep store and allocates the file. The header is
+    the magic string CDSTORE1, the header length as a little-endian uint64,
+    and the header as JSON, padded to a multiple of 4096 bytes. If the
+    arrays have no offsets, they are laid out uncompressed after the header.
+    :param filename: store file name (.cds).
+    :param arrays: dictionary with the layout (dtype, shape and optionally
+        offset or chunks) of each array.
+    :param metadata: dictionary with metadata to save in the header.
+    :param data_nbytes: size of the data after the header. If None it is
+        computed from the uncompressed layout.
+    :return: size of the header in bytes, where the data starts.
+    """
+    offset = 0
+    for layout in arrays.values():
+        if "chunks" not in layout:
+            layout["offset"] = offset
+            nbytes = int(np.prod(layout["shape"])) * np.dtype(layout["dtype"]).itemsize
+            offset += -(-nbytes // 64) * 64 # align arrays to 64 bytes
+    if data_nbytes is None:
+        data_nbytes = offset
+
+    header = json.dumps({"metadata": metadata, "arrays": arrays}).encode()
+    header_nbytes = -(-(len(header) + 16) // 4096) * 4096
+    with open(filename, "wb") as f:
+        f.write(b"CDSTORE1" + np.uint64(len(header)).astype("<u8").tobytes() + header)
+        f.truncate(header_nbytes + data_nbytes)
+    return header_nbytes
+
+class SweepStore():
+    """
+    Sweep store file opened for reading or appending. See
+    create_sweep_store() for the file format. Arrays are accessed by name,
+    uncompressed arrays are memory mapped and compressed arrays are
+    decompressed when accessed.
+    """
+    def __init__(self, filename, mode="r"):
+        """
+        :param filename: store file name (.cds).
+        :param mode: "r" for reading or "r+" for appending.
+        """
+        self.filename = filename
+        self.mode = mode
+        with open(filename, "rb") as f:
+            if f.read(8) != b"CDSTORE1":
+                raise ValueError(filename + " is not a sweep store.")
+            header_len = int(np.frombuffer(f.read(8), "<u8")[0])
+            header = json.loads(f.read(header_len))
+        self.data_offset = -(-(header_len + 16) // 4096) * 4096
+        self.metadata = header["metadata"]
+        self.layout = header["arrays"]
+        self.fields = list(self.layout.keys())
+        self.arrays = {}
+        self.count = 0
+        if "steps" in self.layout:
+            self.count = int(np.sum(self["steps"] >= 0))
+
+    def __getitem__(self, name):
+        if name in self.arrays:
+            return self.arrays[name]
+        layout = self.layout[name]
+        dtype, shape = np.dtype(layout["dtype"]), tuple(layout["shape"])
+        if "chunks" in layout:
+            chunks = []
+            with open(self.filename, "rb") as f:
+                for offset, nbytes in layout["chunks"]:
+                    f.seek(self.data_offset + offset)
+                    chunks.append(zlib.decompress(f.read(nbytes)))
+            return np.frombuffer(b"".join(chunks), dtype).reshape(shape)
+        self.arrays[name] = np.memmap(self.filename, dtype, self.mode, 
+            self.data_offset + layout["offset"], shape or (1,)).reshape(shape)
+        return self.arrays[name]
+
+    def append(self, step, **rows):
+        """
+        Writes the rows of a new step in the next free row of the arrays.
+        :param step: step of the rows (for example, a test bin).
+        :param rows: data of the row of each array.
+        """
+        if self.count >= len(self["steps"]):
+            raise IndexError("Sweep store " + self.filename + " is full.")
+        for name, data in rows.items():
+            self[name][self.count] = data
+        # mark row as done after writing the data
+        self["steps"][self.count] = step
+        self.count += 1
+
+    def flush(self):
+        for data in self.arrays.values():
+            data.flush()
+
+    def close(self):
+        if self.mode != "r":
+            self.flush()
+        self.arrays = {}
+
+class SpectraRecorder():
+    """
+    Streams frames of data (e.g. spectra in the native integer type of the
+    brams) into a rolling set of memory mapped sweep stores, named
+    <prefix>_00000.cds, <prefix>_00001.cds, ..., of frames_per_file frames
+    each. Every frame is written to disk with its frame index (the "steps"
+    array) and a timestamp, so the memory footprint is constant, runs can be
+    indefinite, and the frames recorded before a crash are kept. If 
+    max_files is given the oldest files are removed, as a ring of files.
+    """
+    def __init__(self, prefix, fields, frames_per_file=1000, max_files=None, metadata={}):
+        """
+        :param prefix: prefix of the store file names, may include directories.
+        :param fields: dictionary with the (size, dtype) of each array of a
+            frame. See create_sweep_store().
+        :param frames_per_file: number of frames of each store file.
+        :param max_files: maximum number of files kept, None to keep all.
+        :param metadata: dictionary with metadata to save in every file.
+        """
+        self.prefix = prefix
+        self.fields = dict(fields, timestamps=((), "<f8"))
+        self.frames_per_file = frames_per_file
+        self.max_files = max_files
+        self.metadata  = metadata
+        self.files = collections.deque()
+        self.store = None
+        self.count = 0 # number of frames recorded
+
+    def append(self, timestamp=None, **frame):
+        """
+        Write a frame, opening a new store file if the current one is full.
+        :param timestamp: time of the frame, current time if None.
+        :param frame: data of each array of the frame.
+        :return: index of the frame.
+        """
+        if self.store is None or self.store.count >= self.frames_per_file:
+            self.next_file()
+        timestamp = time.time() if timestamp is None else timestamp
+        self.store.append(self.count, timestamps=timestamp, **frame)
+        self.count += 1
+        return self.count - 1
+
+    def next_file(self):
+        """
+        Close the current store file and create the next one.
+        """
+        if self.store is not None:
+            self.store.close()
+        filename = self.prefix + "_%05d.cds" % (self.count // self.frames_per_file)
+        self.store = create_sweep_store(filename, self.frames_per_file, self.fields, 
+            dict(self.metadata, first_frame=self.count))
+        self.files.append(filename)
+        if self.max_files is not None and len(self.files) > self.max_files:
+            os.remove(self.files.popleft())
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+def read_spectra_recording(prefix, names=None):
+    """
+    Reads the frames recorded by a SpectraRecorder, skipping the unwritten 
+    frames of the last file.
+    :param prefix: prefix of the store file names.
+    :param names: names of the arrays to read, None to read all.
+    :return: dictionary with the read arrays, including "steps" (the frame
+        indexes) and "timestamps".
+    """
+    directory = os.path.dirname(prefix) or "."
+    basename  = os.path.basename(prefix)
+    matches = [re.fullmatch(re.escape(basename) + r"_(\d+)\.cds", filename) 
+        for filename in os.listdir(directory)]
+    filenames = sorted([match.group(0) for match in matches if match], 
+        key=lambda filename: int(filename[len(basename)+1:-4]))
+    arrays = collections.defaultdict(list)
+    for filename in filenames:
+        store = SweepStore(os.path.join(directory, filename))
+        valid = store["steps"] >= 0
+        for name in store.fields:
+            if names is None or name in names + ["steps", "timestamps"]:
+                arrays[name].append(np.array(store[name][valid]))
+        store.close()
+    return {name: np.concatenate(data) for name, data in arrays.items()}
+
+class AcquisitionThread(threading.Thread):
+    """
+    Background thread that acquires frames continuously into a latest-frame-
+    wins buffer, so that plotting never waits for the rfsoc. Frames are
+    acquired into a ring of three buffers: the latest frame and the frame
+    being rendered are never overwritten.
+    """
+    def __init__(self, acquire, make_buffer=None):
+        """
+        :param acquire: function that acquires a frame. It gets a buffer to
+            acquire into (None if make_buffer is None) and returns the frame.
+        :param make_buffer: function with no arguments that returns a new
+            buffer for acquire.
+        """
+        super().__init__(daemon=True)
+        self.acquire = acquire
+        self.buffers = [make_buffer() if make_buffer else None for _ in range(3)]
+        self.lock    = threading.Lock()
+        self.stopped = threading.Event()
+        self.latest  = None # (buffer index, frame)
+        self.reading = None # buffer index being rendered
+        self.seq     = 0
+        self.read_seq = 0
+        self.error    = None
+        self.rate     = RateCounter()
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                with self.lock:
+                    used  = [self.reading, self.latest[0] if self.latest else None]
+                    index = [i for i in range(3) if i not in used][0]
+                frame = self.acquire(self.buffers[index])
+                with self.lock:
+                    self.latest = (index, frame)
+                    self.seq += 1
+                self.rate.tick()
+        except Exception as e:
+            self.error = e
+
+    def get_latest(self):
+        """
+        Get the newest acquired frame, if it was not already returned. The
+        frame is not overwritten until the next call.
+        :return: latest frame, or None if there is no new frame.
+        """
+        if self.error is not None:
+            raise self.error
+        with self.lock:
+            if self.seq == self.read_seq:
+                self.reading = None
+                return None
+            self.read_seq = self.seq
+            self.reading, frame = self.latest
+            return frame
+
+    def stop(self):
+        self.stopped.set()
+
+class RateCounter():
+    """
+    Measures the rate of events (e.g. frames per second), averaged over the 
+    last nevents events.
+    """
+    def __init__(self, nevents=10):
+        self.times = collections.deque(maxlen=nevents+1)
+
+    def tick(self):
+        self.times.append(time.perf_counter())
+
+    def get_rate(self):
+        """
+        :return: rate in events per second, 0 if there are not enough events.
+        """
+        if len(self.times) < 2 or self.times[-1] == self.times[0]:
+            return 0.0
+        return (len(self.times)-1) / (self.times[-1] - self.times[0])
+
+class MinMaxDecimator():
+    """
+    Decimates the data of a plot line to the pixel width of its axis, keeping
+    the minimum and maximum of the points of each pixel, so that narrow 
+    tones stay visible. The decimation index map is recomputed only when the
+    axis is resized.
+    """
+    def __init__(self, ax, x, enabled=True):
+        """
+        :param ax: matplotlib axis of the line.
+        :param x: x data of the line.
+        :param enabled: if False the data is not decimated.
+        """
+        self.ax = ax
+        self.x  = np.asarray(x)
+        self.enabled = enabled
+        self.width   = None
+
+    def __call__(self, y):
+        """
+        Decimate y data.
+        :param y: y data of the line, same length as x.
+        :return: decimated x and y data.
+        """
+        if not self.enabled:
+            return self.x, y
+        width = int(self.ax.bbox.width)
+        if width != self.width:
+            self.width  = width
+            self.starts = get_minmax_starts(len(self.x), width)
+            if self.starts is not None:
+                self.x_dec = np.repeat(self.x[self.starts], 2)
+        if self.starts is None:
+            return self.x, y
+        y_dec = np.empty(2*len(self.starts), dtype=np.result_type(y))
+        np.minimum.reduceat(y, self.starts, out=y_dec[0::2])
+        np.maximum.reduceat(y, self.starts, out=y_dec[1::2])
+        return self.x_dec, y_dec
+
+@functools.lru_cache(maxsize=64)
+def get_minmax_starts(npoints, npixels):
+    """
+    Get the start index of the points of each pixel for min/max decimation.
+    :param npoints: number of points of the line.
+    :param npixels: number of pixels.
+    :return: array of start indices, or None if there is no need to decimate.
+    """
+    if npixels < 1 or npoints <= 2*npixels:
+        return None
+    return np.unique(np.linspace(0, npoints, npixels, endpoint=False).astype(int))
 
-def scale_and_dBFS_specdata(data, acclen, dBFS):
+class RingBuffer():
+    """
+    Preallocated ring buffer of the last nrows rows of data (e.g. frames of
+    spectra for a waterfall). Appending a row writes only that row.
+    """
+    def __init__(self, nrows, row_shape, dtype=np.float32):
+        """
+        :param nrows: number of rows kept.
+        :param row_shape: shape of each row.
+        :param dtype: data type of the buffer.
+        """
+        self.data  = np.full((nrows,) + tuple(np.atleast_1d(row_shape)), np.nan, dtype)
+        self.head  = 0 # index where the next row is written
+        self.count = 0 # number of rows written, up to nrows
+
+    def append(self, row):
+        """
+        Write a row over the oldest row.
+        """
+        self.data[self.head] = row
+        self.head  = (self.head + 1) % len(self.data)
+        self.count = min(self.count + 1, len(self.data))
+
+    def get_views(self):
+        """
+        Get the rows in chronological order without copying them.
+        :return: views of the older rows (from head to the end of the buffer)
+            and of the newer rows (from the start of the buffer to head).
+        """
+        if self.count < len(self.data):
+            return self.data[:0], self.data[:self.head]
+        return self.data[self.head:], self.data[:self.head]
+
+@functools.lru_cache(maxsize=16)
+def get_fft_window(nfft, window="hanning"):
+    """
+    Get a window for FFTs of nfft samples. The window is cached and read-only.
+    :param nfft: number of samples of the FFT.
+    :param window: name of the Numpy window function (hanning, hamming,
+        blackman, bartlett).
+    :return: array with the window.
+    """
+    window = getattr(np, window)(nfft)
+    window.flags.writeable = False
+    return window
+
+@functools.lru_cache(maxsize=16)
+def get_rfft_freqs(nfft, bandwidth):
+    """
+    Get the frequencies of the bins of a real FFT of nfft samples. The 
+    frequencies are cached and read-only.
+    :param nfft: number of samples of the FFT.
+    :param bandwidth: bandwidth of the sampled signal (half the sample rate).
+    :return: array with the nfft//2+1 frequencies, from 0 to bandwidth.
+    """
+    freqs = np.fft.rfftfreq(nfft, 1/(2*bandwidth))
+    freqs.flags.writeable = False
+    return freqs
+
+def compute_welch_spectra(data, nfft, overlap=0.5, window="hanning", out=None):
+    """
+    Computes the power spectra of several channels of samples at once, 
+    averaging the spectra of overlapping windowed segments of every channel
+    (Welch method). The segments of all the channels are strided views of 
+    the data, transformed with a single batched real FFT.
+    :param data: 2D array of samples, one channel per row.
+    :param nfft: number of samples of each segment.
+    :param overlap: fraction of overlap between consecutive segments.
+    :param window: name of the window function, see get_fft_window().
+    :param out: optional preallocated array where to write the spectra.
+    :return: array with the power spectra (squared magnitude of the FFT
+        averaged over segments), one channel per row. Use it with 
+        scale_and_dBFS_specdata() to convert it to dBFS.
+    """
+    step = max(int(nfft * (1-overlap)), 1)
+    segments = np.lib.stride_tricks.sliding_window_view(data, nfft, axis=-1)[..., ::step, :]
+    spectra  = np.fft.rfft(segments * get_fft_window(nfft, window), axis=-1)
+    power = np.square(spectra.real)
+    power += np.square(spectra.imag)
+    return np.mean(power, axis=-2, out=out)
+
+def scale_and_dBFS_specdata(data, acclen, dBFS, out=None, dtype=float):
     """
     Scales spectral data by an accumulation length, and converts
-    the data to dBFS. Used for plotting spectra.
+    the data to dBFS. Used for plotting spectra. A whole frame of spectra
+    (2D array with one spectrum per row) can be converted at once, in place
+    or into a preallocated array, without temporary arrays.
     :param data: spectral data to convert. Must be Numpy array.
     :param acclen: accumulation length of spectrometer.
         Used to scale the data.
     :param dBFS: amount to shift the dB data is shifted in order
         to converted it to dBFS. It is usually computed as:
         dBFS = 6.02 adc_bits + 10*log10(spec_channels)
+    :param out: optional preallocated floating point array where to write 
+        the converted data. Use out=data to convert float data in place.
+    :param dtype: data type of the returned array if out is None (e.g. 
+        np.float32 for plotting).
     :return: scaled data in dBFS.
     """
+    if out is None:
+        out = np.empty(np.shape(data), dtype)
     # scale data
-    data = data / acclen
+    np.divide(data, acclen, out=out)
     # convert data to dBFS
-    data = 10*np.log10(data+1) - dBFS
-    return data
+    out += 1
+    np.log10(out, out=out)
+    out *= 10
+    out -= dBFS
+    return out
 
 def float2fixed(data, nbits, binpt, signed=True, warn=True):
     """
@@ -116,16 +1319,14 @@ def float2fixed(data, nbits, binpt, signed=True, warn=True):
     :param binpt: binary point of the fixed point format.
     :param signed: if true use signed representation, else use unsigned.
     :param warn: if true print overflow warinings.
-    :return: data in fixed point format.
+    :return: data in fixed point format, with the shape of data.
     """
     if warn:
         check_overflow(data, nbits, binpt, signed)
 
-    nbytes = int(np.ceil(nbits/8))
-    dtype = '>i'+str(nbytes) if signed else '>u'+str(nbytes)
-
-    fixedpoint_data = (2**binpt * data).astype(dtype)
-    return fixedpoint_data
+    fixedpoint_data, _ = encode_fixed(data, nbits, binpt, signed, saturate=False)
+    # encode_fixed flattens the data (complex data has an extra first axis)
+    return fixedpoint_data.reshape(fixedpoint_data.shape[:-1] + np.shape(data))
 
 def check_overflow(data, nbits, binpt, signed):
     """
@@ -135,15 +1336,12 @@ def check_overflow(data, nbits, binpt, signed):
     :param nbits: number of bits of the fixed point format.
     :param binpt: binary point of the fixed point format.
     :param signed: if true use signed representation, else use unsigned.
+    :return: number of values that exceed the limit values.
     """
-    if signed:
-        # limit values for signed fixed point
-        max_val = ( 2.0**(nbits-1)-1) / (2**binpt)
-        min_val = (-2.0**(nbits-1))   / (2**binpt)
-    else:
-        # limit values for unsigned fixed point
-        max_val = ( 2.0** nbits   -1) / (2**binpt)
-        min_val =   0
+    # limit values of the fixed point format
+    _, min_int, max_int = get_fixed_format(nbits, signed)
+    max_val = max_int / 2**binpt
+    min_val = min_int / 2**binpt
 
     # check overflow
     if np.max(data) > max_val:
@@ -154,6 +1352,127 @@ def check_overflow(data, nbits, binpt, signed):
         warnings.warn("Minimum value exceeded in overflow check.\n" + \
             "Min allowed value: " + str(min_val) + "\n" + \
             "Min value in data: " + str(np.min(data)))
+    return int(np.count_nonzero((np.asarray(data) > max_val) | (np.asarray(data) < min_val)))
+
+def get_fixed_format(nbits, signed=True):
+    """
+    Get the numpy dtype and the integer limits of a fixed point format.
+    :param nbits: number of bits of the fixed point format.
+    :param signed: if true use signed representation, else use unsigned.
+    :return: big-endian dtype, minimum and maximum integer values.
+    """
+    nbytes = [n for n in [1, 2, 4, 8] if 8*n >= nbits][0]
+    if signed:
+        return np.dtype(">i"+str(nbytes)), -2**(nbits-1), 2**(nbits-1)-1
+    else:
+        return np.dtype(">u"+str(nbytes)), 0, 2**nbits-1
+
+def encode_fixed(arrays, nbits, binpt, signed=True, rounding="truncate", 
+    saturate=True, nbrams=1, chunk_size=2**14):
+    """
+    Encode arrays of floating points into big-endian fixed point format, with
+    width number of bits nbits, and binary point binpt. Every array is 
+    scaled, rounded, checked for overflow and converted in a single pass, 
+    in chunks of chunk_size values.
+    Complex arrays are encoded with the real part in index 0 of a new first
+    axis and the imaginary part in index 1. If nbrams > 1 the data is also
+    deinterleaved, so that the encoded data of bram k is in index k of the 
+    second to last axis, ready to write with write_bram_data().
+    :param arrays: array or list of arrays to encode.
+    :param nbits: number of bits of the fixed point format.
+    :param binpt: binary point of the fixed point format.
+    :param signed: if true use signed representation, else use unsigned.
+    :param rounding: "truncate" to truncate towards zero, or "round" to round
+        half to even.
+    :param saturate: if True overflowed values are saturated to the limit
+        values, else they wrap around as in the hardware.
+    :param nbrams: number of brams to deinterleave the data into.
+    :param chunk_size: number of values processed at a time.
+    :return: encoded array (or list of arrays), and number of overflowed
+        values (or list with the numbers for each array).
+    """
+    if rounding not in ["truncate", "round"]:
+        raise ValueError("Invalid rounding mode: " + str(rounding))
+    single = not isinstance(arrays, (list, tuple))
+    if single:
+        arrays = [arrays]
+    dtype, min_int, max_int = get_fixed_format(nbits, signed)
+    scale = 2.0**binpt
+    chunk_rows = max(chunk_size // nbrams, 1)
+    chunk_buf = np.empty(chunk_rows*nbrams)
+
+    fixed_list = []; noverflow_list = []
+    for data in arrays:
+        data = np.ravel(data)
+        parts = [data.real, data.imag] if np.iscomplexobj(data) else [data]
+        fixed = np.empty((len(parts), nbrams, len(data)//nbrams), dtype)
+        noverflow = 0
+        for part, out in zip(parts, fixed):
+            # interleaved views of input and output
+            part = part.reshape(-1, nbrams)
+            out  = out.T
+            for i in range(0, len(part), chunk_rows):
+                part_chunk = part[i:i+chunk_rows]
+                chunk = chunk_buf[:part_chunk.size].reshape(part_chunk.shape)
+                np.multiply(part_chunk, scale, out=chunk)
+                if rounding == "round":
+                    np.rint(chunk, out=chunk)
+                else:
+                    np.trunc(chunk, out=chunk)
+                noverflow += np.count_nonzero(chunk > max_int) + \
+                    np.count_nonzero(chunk < min_int)
+                if saturate:
+                    np.clip(chunk, min_int, max_int, out=chunk)
+                else:
+                    chunk -= min_int
+                    np.mod(chunk, 2.0**nbits, out=chunk)
+                    chunk += min_int
+                out[i:i+chunk_rows] = chunk
+        if len(parts) == 1:
+            fixed = fixed[0]
+        if nbrams == 1:
+            fixed = fixed.reshape(fixed.shape[:-2] + (-1,))
+        fixed_list.append(fixed); noverflow_list.append(int(noverflow))
+
+    if single:
+        return fixed_list[0], noverflow_list[0]
+    return fixed_list, noverflow_list
+
+def decode_fixed(arrays, binpt, iscomplex=False, nbrams=1, out_dtype=float):
+    """
+    Decode arrays of fixed points into floating points, inverse of
+    encode_fixed(). The integer dtype of the arrays gives the number of bits.
+    :param arrays: array or list of arrays to decode.
+    :param binpt: binary point of the fixed point format.
+    :param iscomplex: if True the arrays have the real part in index 0 and 
+        the imaginary part in index 1 of the first axis.
+    :param nbrams: number of brams the data was deinterleaved into.
+    :param out_dtype: floating point dtype of the output.
+    :return: decoded array (or list of arrays).
+    """
+    single = not isinstance(arrays, (list, tuple))
+    if single:
+        arrays = [arrays]
+    scale = 2.0**-binpt
+    
+    data_list = []
+    for fixed in arrays:
+        fixed = np.asarray(fixed)
+        parts = fixed if iscomplex else [fixed]
+        if iscomplex:
+            data = np.empty(parts[0].size, np.result_type(out_dtype, np.complex64))
+            outs = [data.real, data.imag]
+        else:
+            data = np.empty(parts[0].size, out_dtype)
+            outs = [data]
+        for part, out in zip(parts, outs):
+            part = part.reshape(nbrams, -1).T
+            np.multiply(part, scale, out=out.reshape(-1, nbrams))
+        data_list.append(data)
+
+    if single:
+        return data_list[0]
+    return data_list
 
 class DummyRFSoC():
     def write_int(self, device, reg):
@@ -164,3 +1483,1005 @@ class DummyRFSoC():
         return 0
     def read(self, device, nbytes, offset=0):
         return bytearray(nbytes)
+
+class SimRFSoC():
+    """
+    Simulated RFSoC. Every device of the register map of the .fpg file is
+    backed by memory. The spectrometer (config [spectra] bram_names), 
+    correlator, and DSS synthesis (config [dss], or sections with 
+    synth_brams) brams, and the ADC snapshots are synthesized from the 
+    simulated inputs and the DSS constants loaded in the const brams. A new 
+    accumulation is synthesized every accumulation time, and the optional 
+    count_reg counts them. Each transaction takes latency plus its number of
+    bytes divided by throughput.
+    The input signal of channel k (index of the spectrum in bram_names) is
+    the sum of the tones, each with gain gains[k] and phase phases[k], plus
+    an extra 90 degrees (-90 for lsb tones) on odd channels, as the IF 
+    outputs of a sideband separating mixer, plus independent noise.
+    The DSS outputs are usb = a + c_usb*b and lsb = b + c_lsb*a, where a and
+    b are the inputs of spec_brams and c_usb, c_lsb the constants. The
+    sideband held by each of synth_brams and const_brams is given by the
+    sidebands key of the section (default ["usb", "lsb"]).
+    """
+    def __init__(self, fpgfile, config, latency=0.0, throughput=None, acc_time=None,
+        seed=None):
+        """
+        :param fpgfile: .fpg file with the register map.
+        :param config: config dictionary of the script.
+        :param latency: time of each transaction (in seconds).
+        :param throughput: transfer speed (in bytes/s). None for no limit.
+        :param acc_time: accumulation time (in seconds). If None it is
+            computed from the acc_len register.
+        :param seed: seed of the noise generator.
+        """
+        self.regmap  = get_register_map(fpgfile)
+        self.memory  = {device: bytearray(size) for device, (_, size) in self.regmap.items()}
+        self.config  = config
+        self.latency = latency
+        self.throughput = throughput
+        self.acc_time   = acc_time
+        self.rng = np.random.default_rng(seed)
+        
+        # spectrometer model
+        spectra = config.get("spectra", {})
+        self.spec_brams = spectra.get("bram_names", [])
+        self.bandwidth  = spectra.get("bandwidth", 1000.0)
+        self.dBFS       = spectra.get("dBFS", 0.0)
+        self.acc_reg    = spectra.get("acc_reg")
+        self.reset_reg  = spectra.get("reset_reg")
+        self.count_reg  = spectra.get("count_reg")
+        self.data_width = spectra.get("data_width", 64)
+        self.n_bins = 2**spectra.get("addr_width", 0) * len((self.spec_brams or [[]])[0])
+        if self.acc_reg in self.memory:
+            self.write_memory_int(self.acc_reg, spectra.get("acc_len", 1))
+
+        # dss models
+        self.dss_list = []
+        for section in config.values():
+            if not isinstance(section, dict) or "synth_brams" not in section:
+                continue
+            dss = dict(section)
+            dss.setdefault("spec_brams", self.spec_brams[:2])
+            dss["channels"] = [self.spec_brams.index(brams) for brams in dss["spec_brams"]]
+            self.dss_list.append(dss)
+        self.const_nbits = config.get("dss", {}).get("const_nbits", 32)
+        self.const_binpt = config.get("dss", {}).get("const_binpt", 0)
+
+        # snapshots
+        snap_names = config.get("snapshots", {}).get("snap_names", [])
+        self.snapshots = {snapname+"_ss": SimSnapshot(self, snapname+"_ss", channel) 
+            for channel, snapname in enumerate(snap_names)
+            if snapname+"_ss_bram" in self.memory}
+
+        self.set_inputs()
+        self.start_time = time.perf_counter()
+        self.acc_count  = -1
+
+    def set_inputs(self, tones=[], noise=1e-6, gains=None, phases=None):
+        """
+        Set the simulated input signals.
+        :param tones: list of dictionaries with the freq (IF frequency in MHz),
+            amp (amplitude relative to full scale), and optionally sideband
+            ("usb" or "lsb") of each tone.
+        :param noise: noise power per bin relative to a full scale tone.
+        :param gains: list of gains of each channel (scalars or arrays with a
+            gain per bin).
+        :param phases: list of phases of each channel in degrees (scalars or
+            arrays with a phase per bin).
+        """
+        nchannels = max(len(self.spec_brams), len(self.snapshots), 1)
+        self.tones  = [dict(tone) for tone in tones]
+        self.noise  = noise
+        self.gains  = gains  if gains  is not None else [1.0]*nchannels
+        self.phases = phases if phases is not None else [0.0]*nchannels
+
+    def is_running(self):
+        return True
+
+    def listdev(self):
+        return sorted(self.memory)
+
+    def upload_to_ram_and_program(self, bitfile):
+        pass
+
+    def read(self, device, size, offset=0):
+        self.transfer(size)
+        self.update()
+        if offset + size <= len(self.memory[device]):
+            return bytes(self.memory[device][offset:offset+size])
+        return self.read_address(self.regmap[device][0] + offset, size)
+
+    def read_address(self, address, size):
+        """
+        Read a range of the address space, that can span several devices, as
+        merged reads do. Addresses with no device read as zeros.
+        """
+        data = bytearray(size)
+        for device, (dev_address, dev_size) in sorted(self.regmap.items(), 
+            key=lambda item: (item[1][0], -item[1][1])):
+            start = max(dev_address, address)
+            end   = min(dev_address + dev_size, address + size)
+            if start < end:
+                data[start-address:end-address] = \
+                    self.memory[device][start-dev_address:end-dev_address]
+        return bytes(data)
+
+    def write(self, device, data, offset=0):
+        self.transfer(len(data))
+        self.memory[device][offset:offset+len(data)] = data
+
+    def read_int(self, device, word_offset=0):
+        self.transfer(4)
+        self.update()
+        return int.from_bytes(self.memory[device][4*word_offset:4*word_offset+4], 
+            "big", signed=True)
+
+    def write_int(self, device, integer, blindwrite=False, word_offset=0):
+        self.transfer(4)
+        self.write_memory_int(device, integer, word_offset)
+        if device == self.reset_reg and integer == 0:
+            self.start_time = time.perf_counter()
+
+    def write_memory_int(self, device, integer, word_offset=0):
+        self.memory[device][4*word_offset:4*word_offset+4] = \
+            (integer & 0xffffffff).to_bytes(4, "big")
+
+    def transfer(self, nbytes):
+        """
+        Wait the simulated time of a transaction of nbytes.
+        """
+        delay = self.latency
+        if self.throughput:
+            delay += nbytes / self.throughput
+        if delay > 0:
+            time.sleep(delay)
+
+    def get_acc_len(self):
+        if self.acc_reg in self.memory:
+            return max(int.from_bytes(self.memory[self.acc_reg][:4], "big"), 1)
+        return 1
+
+    def update(self):
+        """
+        Synthesize a new accumulation if the accumulation time has passed.
+        """
+        acc_time = self.acc_time
+        if acc_time is None:
+            acc_time = get_acc_time(self.n_bins, self.bandwidth, self.get_acc_len())
+        acc_count = int((time.perf_counter() - self.start_time) / acc_time)
+        if acc_count == self.acc_count:
+            return
+        self.acc_count = acc_count
+        if self.count_reg in self.memory:
+            self.write_memory_int(self.count_reg, acc_count)
+        self.synthesize_spectra()
+
+    def get_channel_spectra(self):
+        """
+        Get the complex amplitude of the signal of each channel in every bin.
+        :return: array with the spectra of each channel.
+        """
+        nchannels = len(self.gains)
+        spectra = np.zeros((nchannels, self.n_bins), dtype=complex)
+        for tone in self.tones:
+            k = int(round(tone["freq"] / self.bandwidth * self.n_bins)) % self.n_bins
+            sign = -1 if tone.get("sideband", "usb") == "lsb" else 1
+            for channel in range(nchannels):
+                phase = np.deg2rad(np.broadcast_to(self.phases[channel], self.n_bins)[k])
+                phase += sign * np.pi/2 * (channel % 2)
+                gain = np.broadcast_to(self.gains[channel], self.n_bins)[k]
+                spectra[channel, k] += tone["amp"] * gain * np.exp(1j*phase)
+        return spectra
+
+    def get_cross_spectra(self, sig_x, sig_y, noise_x, noise_y, acc_len, auto=False):
+        """
+        Get the accumulated cross-spectrum of two signals with independent
+        noise (or the power spectrum if auto is True), drawing its 
+        fluctuations around the expected value for acc_len spectra.
+        :param sig_x: complex amplitude of the signal of input x.
+        :param sig_y: complex amplitude of the signal of input y.
+        :param noise_x: noise power of input x.
+        :param noise_y: noise power of input y.
+        :param acc_len: number of accumulated spectra.
+        :param auto: if True x and y are the same input.
+        :return: complex cross-spectrum scaled to full scale counts.
+        """
+        mean = sig_x * np.conj(sig_y)
+        var  = np.abs(sig_x)**2 * noise_y + noise_x * np.abs(sig_y)**2 + noise_x*noise_y
+        if auto:
+            mean = mean + noise_x
+            fluct = np.sqrt(var/acc_len) * self.rng.standard_normal(self.n_bins)
+        else:
+            fluct = np.sqrt(var/(2*acc_len)) * (self.rng.standard_normal(self.n_bins) + 
+                1j*self.rng.standard_normal(self.n_bins))
+        return (mean + fluct) * acc_len * 10**(self.dBFS/10)
+
+    def write_spectrum(self, brams, data, signed):
+        """
+        Write a simulated spectrum into interleaved brams.
+        """
+        dtype = (">i" if signed else ">u") + str(self.data_width//8)
+        info  = np.iinfo(dtype)
+        data  = np.clip(np.round(data), info.min, info.max).astype(dtype)
+        for bram, bramdata in deinterleave_data(brams, data).items():
+            self.memory[bram][:len(bramdata)] = bramdata
+
+    def read_consts(self, brams):
+        """
+        Read the complex constants loaded into the const brams.
+        """
+        dtype, _, _ = get_fixed_format(self.const_nbits)
+        parts = []
+        for part_brams in brams:
+            nbytes = self.n_bins // len(part_brams) * dtype.itemsize
+            rawdata = b"".join(bytes(self.memory[bram][:nbytes]) for bram in part_brams)
+            parts.append(np.frombuffer(rawdata, dtype))
+        return decode_fixed(np.array(parts), self.const_binpt, iscomplex=True, 
+            nbrams=len(brams[0]))
+
+    def synthesize_spectra(self):
+        """
+        Synthesize the spectrometer, correlator and DSS synthesis brams.
+        """
+        if self.n_bins == 0:
+            return
+        acc_len = self.get_acc_len()
+        spectra = self.get_channel_spectra()
+        noise = self.noise
+        for channel, brams in enumerate(self.spec_brams):
+            power = self.get_cross_spectra(spectra[channel], spectra[channel], 
+                noise, noise, acc_len, auto=True)
+            self.write_spectrum(brams, power.real, False)
+
+        for dss in self.dss_list:
+            ch_a, ch_b = dss["channels"]
+            sig_a, sig_b = spectra[ch_a], spectra[ch_b]
+            # correlator
+            ab = self.get_cross_spectra(sig_a, sig_b, noise, noise, acc_len)
+            self.write_spectrum(dss["corr_brams"][0], ab.real, True)
+            self.write_spectrum(dss["corr_brams"][1], ab.imag, True)
+            # synthesis: usb = a + c_usb*b, lsb = b + c_lsb*a, each output and
+            # constant in the brams of its sideband (config key sidebands)
+            sidebands = dss.get("sidebands", ["usb", "lsb"])
+            for sideband, brams, const_brams in zip(sidebands, dss["synth_brams"],
+                dss["const_brams"]):
+                consts = self.read_consts(const_brams)
+                if sideband == "usb":
+                    sig = sig_a + consts*sig_b
+                else:
+                    sig = sig_b + consts*sig_a
+                sig_noise = noise*(1 + np.abs(consts)**2)
+                power = self.get_cross_spectra(sig, sig, sig_noise, sig_noise, 
+                    acc_len, auto=True)
+                self.write_spectrum(brams, power.real, False)
+
+    def synthesize_samples(self, channel, nsamples):
+        """
+        Synthesize ADC samples of a channel.
+        :param channel: channel index.
+        :param nsamples: number of samples.
+        :return: int16 array of samples.
+        """
+        fs = 2 * self.bandwidth * 1e6
+        t  = np.arange(nsamples) / fs + self.rng.uniform(0, 1)
+        n_bins = max(self.n_bins, 1)
+        samples = np.sqrt(self.noise * n_bins / 2) * self.rng.standard_normal(nsamples)
+        for tone in self.tones:
+            k = int(round(tone["freq"] / self.bandwidth * n_bins)) % n_bins
+            sign = -1 if tone.get("sideband", "usb") == "lsb" else 1
+            phase = np.deg2rad(np.broadcast_to(self.phases[channel], n_bins)[k])
+            phase += sign * np.pi/2 * (channel % 2)
+            gain = np.broadcast_to(self.gains[channel], n_bins)[k]
+            samples += tone["amp"] * gain * np.cos(2*np.pi*tone["freq"]*1e6*t + phase)
+        return np.clip(np.round(samples * (2**15-1)), -2**15, 2**15-1).astype(np.int16)
+
+class SimSnapshot():
+    """
+    Simulated snapshot block of SimRFSoC. Arming it captures new samples
+    into its bram.
+    """
+    def __init__(self, rfsoc, name, channel, width_bits=128):
+        self.rfsoc = rfsoc
+        self.name  = name
+        self.channel = channel
+        self.width_bits = width_bits
+
+    def arm(self, *args, **kwargs):
+        self.rfsoc.transfer(4)
+        bram = self.rfsoc.memory[self.name + "_bram"]
+        nsamples = len(bram) // 2
+        samples = self.rfsoc.synthesize_samples(self.channel, nsamples)
+        # encode samples as read by decode_snapshot_data()
+        words = samples.reshape(-1, self.width_bits//16)[:, ::-1]
+        bram[:] = words.astype(">i2").tobytes()
+
+    def read_raw(self, arm=True, **kwargs):
+        if arm:
+            self.arm()
+        # casperfpga polls the status register before reading the bram
+        self.rfsoc.read_int(self.name + "_status")
+        rawdata = self.rfsoc.read(self.name + "_bram", len(self.rfsoc.memory[self.name + "_bram"]))
+        return {"data": rawdata}, None
+
+class SimGenerator():
+    """
+    Simulated RF signal generator for SimRFSoC, with the pyvisa resource
+    interface used by the scripts (write("outp on"), query("freq <f> ghz;
+    *opc?"), ...). The generator tone is downconverted with an LO of
+    frequency lo_freq, so it is set as the input tone of the simulated
+    rfsoc, in the sideband given by its frequency relative to the LO. The
+    power commands are ignored, the tone has amplitude amp.
+    """
+    freq_units = {"hz": 1e-9, "khz": 1e-6, "mhz": 1e-3, "ghz": 1.0}
+
+    def __init__(self, rfsoc, lo_freq, amp=0.5):
+        """
+        :param rfsoc: SimRFSoC object.
+        :param lo_freq: LO frequency in GHz.
+        :param amp: amplitude of the tone relative to full scale.
+        """
+        self.rfsoc   = rfsoc
+        self.lo_freq = lo_freq
+        self.amp     = amp
+        self.freq    = None # GHz
+        self.output  = False
+
+    def write(self, command):
+        for words in [cmd.lower().split() for cmd in command.split(";")]:
+            if words[:1] == ["freq"]:
+                unit = words[2] if len(words) > 2 else "hz"
+                self.freq = float(words[1]) * self.freq_units[unit]
+            elif words[:1] == ["outp"]:
+                self.output = words[1] in ["on", "1"]
+        self.update()
+
+    def query(self, command):
+        self.write(command)
+        return "1"
+
+    def update(self):
+        """
+        Set the tone of the generator in the rfsoc inputs, keeping the noise,
+        gains and phases.
+        """
+        tones = []
+        if self.output and self.freq is not None:
+            tones = [{"freq": abs(self.freq - self.lo_freq)*1e3, "amp": self.amp,
+                "sideband": "usb" if self.freq > self.lo_freq else "lsb"}]
+        self.rfsoc.set_inputs(tones, self.rfsoc.noise, self.rfsoc.gains, self.rfsoc.phases)
+
+    def close(self):
+        pass
+
+class SimResourceManager():
+    """
+    Simulated pyvisa resource manager, whose resources are SimGenerators
+    of a simulated rfsoc.
+    """
+    def __init__(self, rfsoc, lo_freq, amp=0.5):
+        """
+        :param rfsoc: SimRFSoC object.
+        :param lo_freq: LO frequency in GHz.
+        :param amp: amplitude of the generator tones relative to full scale.
+        """
+        self.rfsoc   = rfsoc
+        self.lo_freq = lo_freq
+        self.amp     = amp
+
+    def open_resource(self, name):
+        return SimGenerator(self.rfsoc, self.lo_freq, self.amp)
+
+    def close(self):
+        pass
+
+class InstrumentedRFSoC():
+    """
+    Wrapper of a CasperFpga object that records every read, write, read_int,
+    write_int, and snapshot arm and read_raw call, with its device name, 
+    number of bytes and wall time. Other attributes are passed to the
+    wrapped object. Use only when the stats are needed, the unwrapped object 
+    has no overhead. The calls are aggregated as they are recorded (see 
+    TrafficRecords), so memory is bounded in indefinite runs.
+    """
+    def __init__(self, rfsoc, maxlen=10000):
+        """
+        :param rfsoc: CasperFpga object to wrap.
+        :param maxlen: number of recent calls kept for the time percentiles
+            and the dumped records.
+        """
+        self.rfsoc = rfsoc
+        self.records = TrafficRecords(maxlen)
+        self.snapshots = InstrumentedSnapshots(rfsoc.snapshots, self.records)
+
+    def __getattr__(self, name):
+        return getattr(self.rfsoc, name)
+
+    def read(self, device, size, offset=0):
+        start_time = time.perf_counter()
+        data = self.rfsoc.read(device, size, offset)
+        self.records.append(("read", device, size, time.perf_counter()-start_time))
+        return data
+
+    def write(self, device, data, offset=0):
+        start_time = time.perf_counter()
+        self.rfsoc.write(device, data, offset)
+        self.records.append(("write", device, len(data), time.perf_counter()-start_time))
+
+    def read_int(self, device, *args, **kwargs):
+        start_time = time.perf_counter()
+        value = self.rfsoc.read_int(device, *args, **kwargs)
+        self.records.append(("read_int", device, 4, time.perf_counter()-start_time))
+        return value
+
+    def write_int(self, device, integer, *args, **kwargs):
+        start_time = time.perf_counter()
+        self.rfsoc.write_int(device, integer, *args, **kwargs)
+        self.records.append(("write_int", device, 4, time.perf_counter()-start_time))
+
+    def get_stats(self):
+        """
+        Get the stats of the recorded calls, grouped by call type and by
+        call type and device.
+        :return: dictionary with count, bytes, total time, and 50, 90 and 99
+            time percentiles (in seconds, of the last maxlen calls) of each 
+            group.
+        """
+        return self.records.get_stats()
+
+    def print_stats(self):
+        """
+        Print the stats of the recorded calls by call type.
+        """
+        print("RFSoC traffic:")
+        for key, st in sorted(self.get_stats().items()):
+            if ":" in key:
+                continue
+            print("    %-16s %7d calls %10d bytes %8.3f [s], p50 %.3f [ms], p99 %.3f [ms]" %
+                (key, st["count"], st["bytes"], st["time"], 1e3*st["p50"], 1e3*st["p99"]))
+
+    def dump_stats(self, filename, records=False):
+        """
+        Save the stats of the recorded calls in a JSON file.
+        :param filename: JSON file name.
+        :param records: if True also save the last maxlen recorded calls.
+        """
+        dump = {"stats": self.get_stats()}
+        if records:
+            dump["records"] = self.records.get_recent()
+        with open(filename, "w") as f:
+            json.dump(dump, f, indent=4, sort_keys=True)
+
+    def reset_stats(self):
+        """
+        Delete the recorded calls.
+        """
+        self.records.clear()
+
+class TrafficRecords():
+    """
+    Records of rfsoc calls (call, device, nbytes, time) of InstrumentedRFSoC,
+    aggregated by call type and by call type and device as they are
+    appended. Only the times of the last maxlen calls of each group (for
+    the percentiles) and the last maxlen calls are kept.
+    """
+    def __init__(self, maxlen=10000):
+        self.maxlen = maxlen
+        self.lock   = threading.Lock()
+        self.clear()
+
+    def append(self, record):
+        call, device, nbytes, call_time = record
+        with self.lock:
+            self.recent.append(record)
+            for key in [call, call + ":" + device]:
+                if key not in self.groups:
+                    self.groups[key] = {"count": 0, "bytes": 0, "time": 0.0, 
+                        "times": collections.deque(maxlen=self.maxlen)}
+                group = self.groups[key]
+                group["count"] += 1
+                group["bytes"] += nbytes
+                group["time"]  += call_time
+                group["times"].append(call_time)
+
+    def get_stats(self):
+        """
+        :return: dictionary with the stats of each group. See
+            InstrumentedRFSoC.get_stats().
+        """
+        with self.lock:
+            groups = {key: dict(group, times=list(group["times"])) 
+                for key, group in self.groups.items()}
+        stats = {}
+        for key, group in groups.items():
+            p50, p90, p99 = np.percentile(group["times"], [50, 90, 99])
+            stats[key] = {"count": group["count"], "bytes": int(group["bytes"]),
+                "time": float(group["time"]), "p50": p50, "p90": p90, "p99": p99}
+        return stats
+
+    def get_recent(self):
+        """
+        :return: list of the last maxlen recorded calls.
+        """
+        with self.lock:
+            return list(self.recent)
+
+    def clear(self):
+        with self.lock:
+            self.groups = {}
+            self.recent = collections.deque(maxlen=self.maxlen)
+
+class InstrumentedSnapshots():
+    """
+    Dictionary-like wrapper of the snapshots of a CasperFpga object, that
+    returns InstrumentedSnapshot objects.
+    """
+    def __init__(self, snapshots, records):
+        self.snapshots = snapshots
+        self.records = records
+        self.wrapped = {}
+
+    def __getitem__(self, name):
+        if name not in self.wrapped:
+            self.wrapped[name] = InstrumentedSnapshot(self.snapshots[name], self.records)
+        return self.wrapped[name]
+
+    def __getattr__(self, name):
+        return getattr(self.snapshots, name)
+
+class InstrumentedSnapshot():
+    """
+    Wrapper of a casperfpga snapshot that records arm and read_raw calls.
+    """
+    def __init__(self, snapshot, records):
+        self.snapshot = snapshot
+        self.records = records
+
+    def __getattr__(self, name):
+        return getattr(self.snapshot, name)
+
+    def arm(self, *args, **kwargs):
+        start_time = time.perf_counter()
+        self.snapshot.arm(*args, **kwargs)
+        self.records.append(("snapshot_arm", self.snapshot.name, 4, 
+            time.perf_counter()-start_time))
+
+    def read_raw(self, *args, **kwargs):
+        start_time = time.perf_counter()
+        rawdata = self.snapshot.read_raw(*args, **kwargs)
+        self.records.append(("snapshot_read", self.snapshot.name, 
+            len(rawdata[0]["data"]), time.perf_counter()-start_time))
+        return rawdata
+
+def escape_katcp(data):
+    """
+    Escape bytes as a katcp message argument.
+    :param data: bytes to escape.
+    :return: escaped bytes.
+    """
+    if len(data) == 0:
+        return b"\\@"
+    for char, escaped in [(b"\\", b"\\\\"), (b" ", b"\\_"), (b"\0", b"\\0"), 
+        (b"\n", b"\\n"), (b"\r", b"\\r"), (b"\x1b", b"\\e"), (b"\t", b"\\t")]:
+        data = data.replace(char, escaped)
+    return data
+
+def unescape_katcp(arg):
+    """
+    Unescape a katcp message argument.
+    :param arg: escaped bytes.
+    :return: unescaped bytes.
+    """
+    if arg == b"\\@":
+        return b""
+    escapes = {b"\\": b"\\", b"_": b" ", b"0": b"\0", b"n": b"\n", b"r": b"\r", 
+        b"e": b"\x1b", b"t": b"\t", b"@": b""}
+    return re.sub(rb"\\(.)", lambda m: escapes[m.group(1)], arg)
+
+def run_katcp_server(rfsoc, fpgfile, host="127.0.0.1", port=7147):
+    """
+    Serve the devices of a simulated RFSoC over katcp, with the requests 
+    used by casperfpga (read, bulkread, write, wordread, wordwrite, listdev,
+    fpgastatus, meta), so that scripts can run against it with program set
+    to false. Blocks until interrupted.
+    :param rfsoc: SimRFSoC object with the devices.
+    :param fpgfile: .fpg file with the ?meta information of the model.
+    :param host: address to listen to.
+    :param port: port to listen to.
+    """
+    server = socketserver.ThreadingTCPServer((host, port), KatcpHandler, 
+        bind_and_activate=False)
+    server.allow_reuse_address = True
+    server.daemon_threads = True
+    server.server_bind(); server.server_activate()
+    server.rfsoc = rfsoc
+    server.lock  = threading.Lock()
+    server.meta  = []
+    if os.path.exists(fpgfile):
+        with open(fpgfile, "rb") as f:
+            for line in f:
+                if line.startswith(b"?quit"):
+                    break
+                if line.startswith(b"?meta"):
+                    server.meta.append(line.split()[1:])
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+class KatcpHandler(socketserver.StreamRequestHandler):
+    """
+    Handler of a katcp connection to run_katcp_server().
+    """
+    def handle(self):
+        self.send(b"#version-connect", [b"katcp-protocol", b"5.0-MI"])
+        self.send(b"#version-connect", [b"katcp-library", b"calandigital-sim"])
+        for line in self.rfile:
+            match = re.match(rb"\?([\w-]+)(\[\d+\])?", line)
+            if match is None:
+                continue
+            name, msgid = match.group(1), match.group(2) or b""
+            args = [unescape_katcp(arg) for arg in 
+                re.split(rb"[ \t]+", line[match.end():].rstrip(b"\r\n")) if arg]
+            try:
+                with self.server.lock:
+                    informs, reply = self.request_reply(name.decode(), args)
+            except Exception as e:
+                informs, reply = [], [b"fail", str(e).encode()]
+            for inform in informs:
+                self.send(b"#" + name + msgid, inform)
+            self.send(b"!" + name + msgid, reply)
+
+    def send(self, name, args):
+        self.wfile.write(b" ".join([name] + [escape_katcp(arg) for arg in args]) + b"\n")
+
+    def request_reply(self, name, args):
+        """
+        Process a request.
+        :return: list of inform arguments, and reply arguments.
+        """
+        rfsoc = self.server.rfsoc
+        if name == "read":
+            device, offset, size = args[0].decode(), int(args[1]), int(args[2])
+            return [], [b"ok", rfsoc.read(device, size, offset)]
+        if name == "bulkread":
+            device, offset, size = args[0].decode(), int(args[1]), int(args[2])
+            data = rfsoc.read(device, size, offset)
+            chunks = [[data[i:i+2**16]] for i in range(0, len(data), 2**16)]
+            return chunks, [b"ok", str(len(data)).encode()]
+        if name == "write":
+            rfsoc.write(args[0].decode(), args[2], int(args[1]))
+            return [], [b"ok"]
+        if name == "wordread":
+            word_offset = int(args[1], 0) if len(args) > 1 else 0
+            value = rfsoc.read_int(args[0].decode(), word_offset) & 0xffffffff
+            return [], [b"ok", ("0x%08x" % value).encode()]
+        if name == "wordwrite":
+            integer = int(args[2], 0)
+            integer = integer - 2**32 if integer >= 2**31 else integer
+            rfsoc.write_int(args[0].decode(), integer, word_offset=int(args[1], 0))
+            return [], [b"ok"]
+        if name == "listdev":
+            detail = len(args) > 0
+            informs = [[device.encode()] + ([("0x%x" % addr).encode(), ("0x%x" % size).encode()] 
+                if detail else []) for device, (addr, size) in sorted(rfsoc.regmap.items())]
+            return informs, [b"ok", str(len(informs)).encode()]
+        if name == "meta":
+            return self.server.meta, [b"ok", str(len(self.server.meta)).encode()]
+        if name in ["fpgastatus", "watchdog", "version-list", "client-list"]:
+            return [], [b"ok"]
+        return [], [b"invalid", b"unknown request " + name.encode()]
+
+class SpectraPublisher():
+    """
+    Publishes frames of spectra over a local TCP socket to any number of
+    subscribers (see SpectraSubscriber), so that the rfsoc is read only once
+    per frame whatever the number of viewers, recorders or analysis scripts.
+    Every frame is sent with a sequence number and a timestamp. Subscribers
+    always get the latest frame: a slow subscriber skips frames instead of
+    delaying the acquisition or the other subscribers.
+    """
+    def __init__(self, shape, dtype, host="127.0.0.1", port=7148, metadata={}):
+        """
+        :param shape: shape of the published frames, e.g. (n_specs, n_bins).
+        :param dtype: data type of the published frames.
+        :param host: address to listen to.
+        :param port: port to listen to.
+        :param metadata: dictionary sent to the subscribers on connection
+            (e.g. spec_names, bandwidth, acc_len).
+        """
+        self.shape  = tuple(shape)
+        self.dtype  = np.dtype(dtype)
+        self.frame  = None # (seq, timestamp, data)
+        self.seq    = 0
+        self.closed = False
+        self.cond   = threading.Condition()
+        self.header = json.dumps({"shape": self.shape, "dtype": self.dtype.str, 
+            "metadata": metadata}).encode() + b"\n"
+        self.server = socketserver.ThreadingTCPServer((host, port), PublisherHandler, 
+            bind_and_activate=False)
+        self.server.allow_reuse_address = True
+        self.server.daemon_threads = True
+        self.server.server_bind(); self.server.server_activate()
+        self.server.publisher = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def publish(self, frame, timestamp=None):
+        """
+        Publish a new frame to all the subscribers.
+        :param frame: array with the frame data.
+        :param timestamp: time of the frame, current time if None.
+        :return: sequence number of the frame.
+        """
+        data = np.ascontiguousarray(frame, self.dtype).tobytes()
+        with self.cond:
+            self.seq += 1
+            self.frame = (self.seq, time.time() if timestamp is None else timestamp, data)
+            self.cond.notify_all()
+        return self.seq
+
+    def get_frame(self, last_seq):
+        """
+        Wait for a frame newer than last_seq.
+        :return: latest frame (seq, timestamp, data), or None if closed.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.closed or self.seq > last_seq)
+            if self.closed:
+                return None
+            return self.frame
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+class PublisherHandler(socketserver.BaseRequestHandler):
+    """
+    Handler of a subscriber connection to SpectraPublisher. Sends a JSON
+    header line with the frame shape, dtype and metadata, then every frame
+    as a little endian (uint64 seq, float64 timestamp) header and the frame
+    data.
+    """
+    def handle(self):
+        publisher = self.server.publisher
+        seq = 0
+        try:
+            self.request.sendall(publisher.header)
+            while True:
+                frame = publisher.get_frame(seq)
+                if frame is None:
+                    return
+                seq, timestamp, data = frame
+                self.request.sendall(struct.pack("<Qd", seq, timestamp) + data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class SpectraSubscriber():
+    """
+    Receives the frames of a SpectraPublisher.
+    """
+    def __init__(self, host="127.0.0.1", port=7148, timeout=None):
+        """
+        :param host: address of the publisher.
+        :param port: port of the publisher.
+        :param timeout: socket timeout in seconds, None to block.
+        """
+        self.sock  = socket.create_connection((host, port), timeout)
+        self.rfile = self.sock.makefile("rb")
+        header = json.loads(self.rfile.readline())
+        self.shape    = tuple(header["shape"])
+        self.dtype    = np.dtype(header["dtype"])
+        self.metadata = header["metadata"]
+        self.buffer   = np.empty(self.shape, self.dtype)
+        self.seq       = 0
+        self.timestamp = None
+        self.skipped   = 0 # frames published but not received
+
+    def read_frame(self, out=None):
+        """
+        Wait for the next frame.
+        :param out: optional preallocated array where to write the frame.
+        :return: sequence number, timestamp and array of the frame.
+        """
+        header = self.rfile.read(16)
+        if len(header) < 16 or self.rfile.readinto(self.buffer.reshape(-1).view(np.uint8)) \
+            < self.buffer.nbytes:
+            raise ConnectionError("spectra publisher closed the connection")
+        seq, self.timestamp = struct.unpack("<Qd", header)
+        if self.seq > 0:
+            self.skipped += seq - self.seq - 1
+        self.seq = seq
+        if out is None:
+            out = np.empty(self.shape, self.dtype)
+        out[...] = self.buffer
+        return self.seq, self.timestamp, out
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+def get_spectra_frame_layout(spectra_config):
+    """
+    Get the layout of a frame of spectra, as read by read_interleave_data_list()
+    in the native integer type of the brams, from the [spectra] section of a
+    config (keys bram_names, addr_width and data_width).
+    :param spectra_config: dictionary of the [spectra] section of the config.
+    :return: shape (n_specs, n_bins) and data type of the frame.
+    """
+    bram_names = spectra_config["bram_names"]
+    n_bins = 2**spectra_config["addr_width"] * len(bram_names[0])
+    dtype  = np.dtype(">u" + str(spectra_config["data_width"]//8)).newbyteorder("=")
+    return (len(bram_names), n_bins), dtype
+
+class SharedFrame():
+    """
+    Latest frame of spectra in a named shared memory segment, so that local
+    consumers (recorders, RFI flaggers, GUIs) can map it zero-copy, without
+    sockets or pickling. A single writer updates the frame with a seqlock:
+    the sequence number in the segment header is odd while the frame is
+    being written, so readers retry their copy if the sequence number was
+    odd or changed during the copy. Each segment created has a new
+    generation number, so readers waiting for frames detect when the writer
+    is restarted with a new segment and re-attach to it.
+    Segment layout: 64 bytes header (uint64 seq, float64 timestamp, uint64 
+    frame nbytes, uint64 generation, padding), then the frame data.
+    """
+    header_nbytes = 64
+
+    def __init__(self, name, shape, dtype, create=False):
+        """
+        :param name: name of the shared memory segment.
+        :param shape: shape of the frame, e.g. (n_specs, n_bins). See
+            get_spectra_frame_layout().
+        :param dtype: data type of the frame.
+        :param create: if True the segment is created (by the writer),
+            replacing any stale segment with the same name, otherwise an
+            existing segment is attached.
+        """
+        self.name   = name
+        self.shape  = tuple(np.atleast_1d(shape))
+        self.dtype  = np.dtype(dtype)
+        self.create = create
+        self.frame_nbytes = nbytes = int(np.prod(shape)) * self.dtype.itemsize
+        if create:
+            try:
+                shm = shared_memory.SharedMemory(name, True, self.header_nbytes + nbytes)
+            except FileExistsError:
+                stale = shared_memory.SharedMemory(name)
+                stale.close(); stale.unlink()
+                shm = shared_memory.SharedMemory(name, True, self.header_nbytes + nbytes)
+            self.map(shm)
+            self.seq[...] = 0
+            self.nbytes[...] = nbytes
+            self.generation[...] = time.time_ns()
+        else:
+            self.map(self.attach())
+            if self.nbytes != nbytes:
+                self.close()
+                raise ValueError("shared frame " + name + " has " + str(int(self.nbytes)) + 
+                    " bytes, expected " + str(nbytes))
+
+    def attach(self):
+        """
+        Attach the segment by name, without tracking it for removal at exit
+        (the segment belongs to the writer).
+        :return: SharedMemory object of the segment.
+        """
+        if sys.version_info >= (3, 13):
+            return shared_memory.SharedMemory(self.name, track=False)
+        shm = shared_memory.SharedMemory(self.name)
+        # the tracker registers the POSIX name, with its leading slash
+        if os.name == "posix":
+            resource_tracker.unregister("/" + shm.name, "shared_memory")
+        return shm
+
+    def map(self, shm):
+        """
+        Map the header fields and the frame of a segment.
+        :param shm: SharedMemory object of the segment.
+        """
+        self.shm = shm
+        self.seq        = np.ndarray((), np.uint64, shm.buf, 0)
+        self.timestamp  = np.ndarray((), np.float64, shm.buf, 8)
+        self.nbytes     = np.ndarray((), np.uint64, shm.buf, 16)
+        self.generation = np.ndarray((), np.uint64, shm.buf, 24)
+        # zero-copy view of the frame, check get_seq() before and after using it
+        self.frame = np.ndarray(self.shape, self.dtype, shm.buf, self.header_nbytes)
+
+    def reattach(self):
+        """
+        Re-attach to the segment with the same name if the writer created a
+        new one (readers).
+        :return: True if a new segment was attached, False if the segment is
+            the same or there is no complete new segment yet.
+        :raise ValueError: if the new segment has a different frame size.
+        """
+        try:
+            shm = self.attach()
+        except FileNotFoundError:
+            return False
+        if shm.size < self.header_nbytes:
+            shm.close()
+            return False
+        generation = int(np.ndarray((), np.uint64, shm.buf, 24))
+        nbytes     = int(np.ndarray((), np.uint64, shm.buf, 16))
+        # generation 0 is a segment not initialized yet by the writer
+        if generation in (0, int(self.generation)):
+            shm.close()
+            return False
+        if nbytes != self.frame_nbytes:
+            shm.close()
+            raise ValueError("shared frame " + self.name + " has " + str(nbytes) + 
+                " bytes, expected " + str(self.frame_nbytes))
+        self.unmap()
+        self.map(shm)
+        return True
+
+    def write(self, frame, timestamp=None):
+        """
+        Write a new frame (single writer).
+        :param frame: array with the frame data.
+        :param timestamp: time of the frame, current time if None.
+        :return: sequence number of the frame.
+        """
+        self.seq += 1
+        self.frame[...] = frame
+        self.timestamp[...] = time.time() if timestamp is None else timestamp
+        self.seq += 1
+        return int(self.seq) // 2
+
+    def get_seq(self):
+        """
+        :return: sequence number of the latest complete frame, 0 if there is
+            no frame yet, or None if a frame is being written.
+        """
+        seq = int(self.seq)
+        return None if seq % 2 else seq // 2
+
+    def read_frame(self, out=None, last_seq=0, poll=1e-3, reattach_time=1.0):
+        """
+        Wait for a frame newer than last_seq and copy it. If there is no new
+        frame for reattach_time, the reader checks if the writer created a
+        new segment and re-attaches to it, then the sequence numbers restart.
+        :param out: optional preallocated array where to write the frame.
+        :param last_seq: sequence number of the last frame read.
+        :param poll: time between checks for a new frame in seconds.
+        :param reattach_time: time without new frames before checking for a
+            new segment in seconds.
+        :return: sequence number, timestamp and array of the frame.
+        """
+        if out is None:
+            out = np.empty(self.shape, self.dtype)
+        wait_start = time.monotonic()
+        while True:
+            seq = int(self.seq)
+            if seq % 2 or seq // 2 <= last_seq:
+                if not self.create and time.monotonic() - wait_start > reattach_time:
+                    wait_start = time.monotonic()
+                    if self.reattach():
+                        last_seq = 0
+                        continue
+                time.sleep(poll)
+                continue
+            out[...] = self.frame
+            timestamp = float(self.timestamp)
+            if int(self.seq) == seq:
+                return seq // 2, timestamp, out
+
+    def unmap(self):
+        """
+        Release the views of the segment and detach it.
+        """
+        self.seq = self.timestamp = self.nbytes = self.generation = self.frame = None
+        self.shm.close()
+
+    def close(self):
+        """
+        Detach the segment. The writer also removes it.
+        """
+        self.unmap()
+        if self.create:
+            self.shm.unlink()
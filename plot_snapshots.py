@@ -2,6 +2,7 @@
 import argparse
 import tomllib
 import calandigital as cd
+import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 
@@ -18,21 +19,56 @@ def main():
     n_bits    = config["snapshots"]["n_bits"]
     snapshots = config["snapshots"]["snap_names"]
     n_samples = config["snapshots"]["n_samples"]
+    spectrum  = config["snapshots"].get("spectrum", False)
+    n_fft     = config["snapshots"].get("n_fft", 256)
+    n_avg     = config["snapshots"].get("n_avg", 8)
 
     # initialize rfsoc
     rfsoc = cd.initialize_rfsoc(config)
     #rfsoc = cd.DummyRFSoC()
 
-    # create figure
-    fig, lines = create_figure(snapshots, n_samples, n_bits)
+    # arm all snapshots together and read their brams in bulk
+    regmap = cd.get_register_map(config["bitfile"])
+    plan   = cd.plan_snapshot_reads(regmap, snapshots)
+
+    if spectrum:
+        # the spectra of all snapshots are computed together, and averaged
+        # over the segments of each snapshot and the last n_avg snapshots
+        bandwidth = config["snapshots"].get("bandwidth") or config["spectra"]["bandwidth"]
+        freqs   = cd.get_rfft_freqs(n_fft, bandwidth)
+        dBFS    = 20*np.log10(2**(n_bits-1) * np.sum(cd.get_fft_window(n_fft)) / 2)
+        history = cd.RingBuffer(n_avg, (len(snapshots), len(freqs)), float)
+        fig, lines, rate_text = create_spectrum_figure(snapshots, bandwidth, dBFS)
+        def acquire(frame):
+            snapdata = np.stack(cd.read_snapshots(rfsoc, snapshots, plan))
+            history.append(cd.compute_welch_spectra(snapdata, n_fft))
+            np.mean(history.data[:history.count], axis=0, out=frame)
+            return cd.scale_and_dBFS_specdata(frame, 1, dBFS, out=frame)
+        make_buffer = lambda: np.empty((len(snapshots), len(freqs)))
+    else:
+        fig, lines, rate_text = create_figure(snapshots, n_samples, n_bits)
+        acquire = lambda _: cd.read_snapshots(rfsoc, snapshots, plan)
+        make_buffer = None
+
+    # acquire snapshots in background, the animation shows the latest frame
+    acquisition = cd.AcquisitionThread(acquire, make_buffer)
+    acquisition.start()
+    render_rate = cd.RateCounter()
 
     # animation function
     def animate(_):
-        snapdata_list = cd.read_snapshots(rfsoc, snapshots)
+        snapdata_list = acquisition.get_latest()
         #snapdata_list = [rfsoc.read(snap, n_bits*n_samples) for snap in snapshots]
-        for line, snapdata in zip(lines, snapdata_list):
-            line.set_data(range(n_samples), snapdata[:n_samples])
-        return lines
+        if snapdata_list is not None:
+            for line, snapdata in zip(lines, snapdata_list):
+                if spectrum:
+                    line.set_data(freqs, snapdata)
+                else:
+                    line.set_data(range(n_samples), snapdata[:n_samples])
+        render_rate.tick()
+        rate_text.set_text("acq: %.1f fps, render: %.1f fps" % 
+            (acquisition.rate.get_rate(), render_rate.get_rate()))
+        return lines + [rate_text]
 
     # run animation
     ani = FuncAnimation(fig, animate, blit=True, cache_frame_data=False)
@@ -60,7 +96,40 @@ def create_figure(snapshots, n_samples, n_bits):
         line, = ax.plot([], [], animated=True)
         lines.append(line)
 
-    return fig, lines
+    # acquisition and render rates
+    ax = axes.flatten()[0]
+    rate_text = ax.text(0.02, 0.98, "", transform=ax.transAxes, va="top", animated=True)
+
+    return fig, lines, rate_text
+
+def create_spectrum_figure(snapshots, bandwidth, dBFS):
+    """
+    Create figure with the proper axes settings for plotting the spectra of
+    snaphots.
+    """
+    axmap = {1 : (1,1), 2 : (1,2), 4 : (2,2), 16 : (4,4)}
+    n_snapshots = len(snapshots)
+
+    fig, axes = plt.subplots(*axmap[n_snapshots], squeeze=False)
+    fig.set_tight_layout(True)
+
+    lines = []
+    for snapshot, ax in zip(snapshots, axes.flatten()):
+        ax.set_xlim(0, bandwidth)
+        ax.set_ylim(-dBFS-2, 0)
+        ax.set_xlabel("Frequency [MHz]")
+        ax.set_ylabel("Power [dBFS]")
+        ax.set_title(snapshot)
+        ax.grid()
+
+        line, = ax.plot([], [], animated=True)
+        lines.append(line)
+
+    # acquisition and render rates
+    ax = axes.flatten()[0]
+    rate_text = ax.text(0.02, 0.98, "", transform=ax.transAxes, va="top", animated=True)
+
+    return fig, lines, rate_text
 
 if __name__ == "__main__":
     main()
@@ -22,6 +22,9 @@ def main():
     reset_reg  = config["spectra"]["reset_reg"]
     acc_reg    = config["spectra"]["acc_reg"]
     acc_len    = config["spectra"]["acc_len"]
+    decimate   = config["spectra"].get("decimate", False)
+    waterfall  = config["spectra"].get("waterfall", False)
+    wf_len     = config["spectra"].get("waterfall_len", 128)
 
     # useful parameters
     n_specs = len(bram_names)
@@ -30,30 +33,84 @@ def main():
     n_bins  = 2**addr_width * n_brams 
     freqs   = np.linspace(0, bandwidth, n_bins, endpoint=False)
 
-    # initialize rfsoc
-    rfsoc = cd.initialize_rfsoc(config)
-    #rfsoc = cd.DummyRFSoC()
+    # get spectra from a spectra publisher instead of the rfsoc, through
+    # shared memory if given, else through its socket
+    shared_name = config.get("shared_frame")
+    publisher   = config.get("publisher") or shared_name
+    if shared_name:
+        shared_frame = cd.SharedFrame(shared_name, *cd.get_spectra_frame_layout(config["spectra"]))
+        last_seq = 0
+    elif publisher:
+        host, port = publisher.rsplit(":", 1)
+        subscriber = cd.SpectraSubscriber(host, int(port))
+        if subscriber.shape != (n_specs, n_bins):
+            raise ValueError("published frames have shape " + str(subscriber.shape) +
+                ", expected " + str((n_specs, n_bins)))
+    else:
+        # plan reads of all spectra brams for each frame
+        regmap = cd.get_register_map(config["bitfile"])
+        plan   = cd.plan_bram_reads(regmap, sum(bram_names, []), 2**addr_width*data_width//8)
+
+        # initialize rfsoc
+        rfsoc = cd.initialize_rfsoc(config)
+        #rfsoc = cd.DummyRFSoC()
 
     # create figure
-    fig, lines = create_figure(n_specs, spec_names, bandwidth, dBFS)
+    if waterfall:
+        fig, images, rate_text = create_waterfall_figure(n_specs, spec_names, 
+            bandwidth, dBFS, wf_len, n_bins)
+        wf_head = 0 # image row of the next frame
+        print("Waterfall history of " + str(wf_len) + " frames (" + 
+            str(sum(image.get_array().nbytes for image in images)//2**20) + " MiB)")
+    else:
+        fig, lines, rate_text = create_figure(n_specs, spec_names, bandwidth, dBFS)
     
-    # initial setting of registers
-    print("Setting accumulation register to " + str(acc_len) + "...", end="")
-    rfsoc.write_int(acc_reg, acc_len)
-    print("done")
-    print("Resseting counter registers...", end="")
-    rfsoc.write_int(reset_reg, 1)
-    rfsoc.write_int(reset_reg, 0)
-    print("done")
+    # initial setting of registers (done by the publisher when subscribed)
+    if not publisher:
+        print("Setting accumulation register to " + str(acc_len) + "...", end="")
+        rfsoc.write_int(acc_reg, acc_len)
+        print("done")
+        print("Resseting counter registers...", end="")
+        rfsoc.write_int(reset_reg, 1)
+        rfsoc.write_int(reset_reg, 0)
+        print("done")
+
+    # acquire spectra in background, the animation shows the latest frame
+    def acquire(frame):
+        nonlocal last_seq
+        if shared_name:
+            last_seq, _, _ = shared_frame.read_frame(frame, last_seq)
+        elif publisher:
+            subscriber.read_frame(frame)
+        else:
+            cd.read_interleave_data_list(rfsoc, bram_names, addr_width, data_width, dtype, plan, frame)
+        return frame
+    acquisition = cd.AcquisitionThread(acquire, lambda: np.empty((n_specs, n_bins)))
+    acquisition.start()
+    render_rate = cd.RateCounter()
+
+    # decimate lines to the axes pixel width
+    if not waterfall:
+        decimators = [cd.MinMaxDecimator(line.axes, freqs, decimate) for line in lines]
 
     # animation definition
     def animate(_):
-        for line, spec_brams in zip(lines, bram_names):
-            # get spectral data
-            spec_data = cd.read_interleave_data(rfsoc, spec_brams, addr_width, data_width, dtype)
-            spec_data = cd.scale_and_dBFS_specdata(spec_data, acc_len, dBFS)
-            line.set_data(freqs, spec_data)
-        return lines
+        nonlocal wf_head
+        # get spectral data
+        frame = acquisition.get_latest()
+        if frame is not None:
+            cd.scale_and_dBFS_specdata(frame, acc_len, dBFS, out=frame)
+            if waterfall:
+                wf_head = update_waterfall(images, frame, wf_head)
+            else:
+                for line, decimator, spec_data in zip(lines, decimators, frame):
+                    line.set_data(*decimator(spec_data))
+        render_rate.tick()
+        rate_text.set_text("acq: %.1f fps, render: %.1f fps" % 
+            (acquisition.rate.get_rate(), render_rate.get_rate()))
+        if waterfall:
+            return images + [rate_text]
+        return lines + [rate_text]
 
     ani = FuncAnimation(fig, animate, blit=True, cache_frame_data=False)
     plt.show()
@@ -79,7 +136,65 @@ def create_figure(n_specs, spec_names, bandwidth, dBFS):
         line, = ax.plot([], [], animated=True)
         lines.append(line)
 
-    return fig, lines
+    # acquisition and render rates
+    ax = axes.flatten()[0]
+    rate_text = ax.text(0.02, 0.98, "", transform=ax.transAxes, va="top", animated=True)
+
+    return fig, lines, rate_text
+
+def create_waterfall_figure(n_specs, spec_names, bandwidth, dBFS, wf_len, n_bins):
+    """
+    Create figure with the proper axes settings for plotting waterfalls of
+    spectra, the newest frame at the top. Each waterfall is an image that
+    holds the history of wf_len frames twice (see update_waterfall()).
+    """
+    axmap = {1 : (1,1), 2 : (1,2), 3 : (2,2), 4 : (2,2), 16 : (4,4)}
+
+    fig, axes = plt.subplots(*axmap[n_specs], squeeze=False, layout="constrained")
+
+    images = []
+    for ax, spec_name in zip(axes.flatten(), spec_names):
+        ax.set_xlim(0, bandwidth)
+        ax.set_ylim(wf_len, 0)
+        ax.set_xlabel("Frequency [MHz]")
+        ax.set_ylabel("Frames ago")
+        ax.set_title(spec_name)
+
+        image = ax.imshow(np.full((2*wf_len, n_bins), np.nan, np.float32), aspect="auto",
+            origin="lower", interpolation="nearest", vmin=-dBFS-2, vmax=0, animated=True,
+            extent=(0, bandwidth, 2*wf_len, 0))
+        images.append(image)
+    fig.colorbar(images[0], ax=axes.flatten().tolist(), label="Power [dBFS]")
+
+    # acquisition and render rates
+    ax = axes.flatten()[0]
+    rate_text = ax.text(0.02, 0.98, "", transform=ax.transAxes, va="top", 
+        color="white", animated=True)
+
+    return fig, images, rate_text
+
+def update_waterfall(images, frame, head):
+    """
+    Add a frame of spectra to the waterfall images. The frame is written in
+    place in the rows head and head + wf_len of the image arrays, so the last
+    wf_len frames are always the contiguous rows head+1 to head+wf_len, which
+    the image extent places by age (the newest at 0, the oldest at wf_len).
+    The other rows fall outside the axes. Only the new rows are written, the
+    image arrays are not copied.
+    :param images: list of images of create_waterfall_figure().
+    :param frame: frame of spectra, one for each image.
+    :param head: image row of the frame.
+    :return: image row of the next frame.
+    """
+    for image, spec_data in zip(images, frame):
+        data   = image.get_array()
+        wf_len = len(data) // 2
+        # masked as set_data() does, so invalid values are not drawn
+        data[[head, head+wf_len]] = np.ma.masked_invalid(spec_data)
+        image.changed()
+        left, right = image.get_extent()[:2]
+        image.set_extent((left, right, head+wf_len+1, head-wf_len+1))
+    return (head + 1) % wf_len
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,30 @@
+# imports
+import argparse
+import tomllib
+import calandigital as cd
+
+# parse command line arguments
+parser = argparse.ArgumentParser(description="Serve a simulated RFSoC model over katcp, so that scripts can run against it.")
+parser.add_argument("config_file", help="TOLM configuration file for script.")
+parser.add_argument("--host", default="127.0.0.1", help="address to listen to.")
+parser.add_argument("--port", type=int, default=7147, help="port to listen to.")
+
+# main function
+def main():
+    # get config data
+    args = parser.parse_args()
+    with open(args.config_file, "rb") as f:
+        config = tomllib.load(f)
+
+    # create simulated rfsoc
+    rfsoc = cd.initialize_sim_rfsoc(config)
+
+    print("Serving " + config["bitfile"] + " at " + args.host + ":" + str(args.port) + 
+        " (set IP to " + args.host + " and program to false in the script config)")
+    try:
+        cd.run_katcp_server(rfsoc, config["bitfile"], args.host, args.port)
+    except KeyboardInterrupt:
+        print("Server stopped")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# imports
+import time
+import argparse
+import tomllib
+import numpy as np
+import calandigital as cd
+
+# parse command line arguments
+parser = argparse.ArgumentParser(description="Read spectra from an spectrometer model in RFSoC once per frame and publish them to any number of local subscribers (e.g. plot_spectra.py with publisher or shared_frame set in its config).")
+parser.add_argument("config_file", help="TOLM configuration file for script.")
+parser.add_argument("--host", default="127.0.0.1", help="address to listen to.")
+parser.add_argument("--port", type=int, default=7148, help="port to listen to.")
+
+# main function
+def main():
+    # get config data
+    args = parser.parse_args()
+    with open(args.config_file, "rb") as f:
+        config = tomllib.load(f)
+    bram_names = config["spectra"]["bram_names"]
+    spec_names = config["spectra"]["spec_names"]
+    addr_width = config["spectra"]["addr_width"]
+    data_width = config["spectra"]["data_width"]
+    bandwidth  = config["spectra"]["bandwidth"]
+    reset_reg  = config["spectra"]["reset_reg"]
+    acc_reg    = config["spectra"]["acc_reg"]
+    acc_len    = config["spectra"]["acc_len"]
+
+    # useful parameters
+    n_specs = len(bram_names)
+    dtype   = ">u" + str(data_width//8)
+
+    # plan reads of all spectra brams for each frame
+    regmap = cd.get_register_map(config["bitfile"])
+    plan   = cd.plan_bram_reads(regmap, sum(bram_names, []), 2**addr_width*data_width//8)
+
+    # initialize rfsoc
+    rfsoc = cd.initialize_rfsoc(config)
+
+    # initial setting of registers
+    print("Setting accumulation register to " + str(acc_len) + "...", end="")
+    rfsoc.write_int(acc_reg, acc_len)
+    print("done")
+    print("Resseting counter registers...", end="")
+    rfsoc.write_int(reset_reg, 1)
+    rfsoc.write_int(reset_reg, 0)
+    print("done")
+
+    # frames are published in the native integer type of the brams
+    frame = np.empty(*cd.get_spectra_frame_layout(config["spectra"]))
+    metadata  = {"spec_names": spec_names[:n_specs], "bandwidth": bandwidth,
+        "acc_len": acc_len}
+    publisher = cd.SpectraPublisher(frame.shape, frame.dtype, args.host, args.port, metadata)
+    print("Publishing spectra at " + args.host + ":" + str(args.port) +
+        " (set publisher to \"" + args.host + ":" + str(args.port) + "\" in the viewers config)")
+
+    # latest frame also in shared memory for local consumers
+    shared_name  = config.get("shared_frame")
+    shared_frame = None
+    if shared_name:
+        shared_frame = cd.SharedFrame(shared_name, frame.shape, frame.dtype, create=True)
+        print("Writing latest frame to shared memory " + shared_name)
+
+    rate = cd.RateCounter()
+    print_time = time.time()
+    try:
+        while True:
+            cd.read_interleave_data_list(rfsoc, bram_names, addr_width, data_width, dtype, plan, frame)
+            timestamp = time.time()
+            seq = publisher.publish(frame, timestamp)
+            if shared_frame:
+                shared_frame.write(frame, timestamp)
+            rate.tick()
+            if time.time() - print_time > 1:
+                print_time = time.time()
+                print("\rFrame " + str(seq) + ", %.1f fps" % rate.get_rate(), end="")
+    except KeyboardInterrupt:
+        print("\nPublisher stopped")
+    finally:
+        publisher.close()
+        if shared_frame:
+            shared_frame.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+# make calandigital importable from the tests
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,39 @@
+# tests of the wait for new accumulations before reading spectra
+import warnings
+import pytest
+import calandigital as cd
+
+class CounterRFSoC():
+    """
+    RFSoC with an accumulation counter that increments on each read, and a
+    bram that never changes.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def read_int(self, device):
+        self.count += 1
+        return self.count
+
+    def read(self, device, size, offset=0):
+        return bytes(size)
+
+def test_settle_detected():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert cd.settle_accumulations(CounterRFSoC(), 1e-3, count_reg="acc_count")
+
+def test_settle_without_detection():
+    # no counter nor watched bram, only the worst case wait
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert not cd.settle_accumulations(CounterRFSoC(), 1e-3)
+
+def test_settle_not_detected():
+    # the watched bram does not change, the timed-out wait is settled
+    with pytest.warns(UserWarning, match="not detected"):
+        assert not cd.settle_accumulations(CounterRFSoC(), 1e-3, retries=1,
+            watch_bram="bram", timeout=0.01)
+    with pytest.raises(RuntimeError):
+        cd.settle_accumulations(CounterRFSoC(), 1e-3, strict=True, watch_bram="bram",
+            timeout=0.01)
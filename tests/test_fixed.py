@@ -0,0 +1,16 @@
+# tests of the fixed point conversion
+import numpy as np
+import pytest
+import calandigital as cd
+
+def test_float2fixed_shape():
+    data = np.linspace(-3, 3, 12).reshape(3, 4)
+    fixed = cd.float2fixed(data, 32, 27)
+    assert fixed.shape == data.shape
+    assert np.array_equal(fixed, (2**27 * data).astype(">i4"))
+
+def test_float2fixed_overflow():
+    # overflowed values wrap around, with the overflow check warning
+    with pytest.warns(UserWarning, match="Maximum value exceeded"):
+        fixed = cd.float2fixed(np.array([1.0, 20.0]), 32, 27)
+    assert fixed[0] == 2**27 and fixed[1] == 20*2**27 - 2**32
@@ -0,0 +1,24 @@
+# tests of the initialization of the simulated RFSoC from the shipped configs
+import os
+import tomllib
+import pytest
+import calandigital as cd
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.mark.parametrize("config_file", [
+    "Spectrometers/bitfiles/spec_2in_2048ch_983mhz_real.toml",
+    "Spectrometers/bitfiles/spec_4in_2048ch_983mhz_real.toml",
+    "Digital-Sideband-Separation/bitfiles/dss_2in_2048ch_983mhz_real.toml"])
+@pytest.mark.parametrize("program", [False, True])
+def test_initialize_sim_rfsoc(config_file, program, monkeypatch):
+    config_file = os.path.join(repo_dir, config_file)
+    monkeypatch.chdir(os.path.dirname(config_file))
+    with open(config_file, "rb") as f:
+        config = tomllib.load(f)
+    config["simulate"] = True
+    config["program"]  = program
+    rfsoc = cd.initialize_rfsoc(config)
+    assert isinstance(rfsoc, cd.SimRFSoC)
+    for bram in config["spectra"]["bram_names"][0]:
+        assert bram in rfsoc.listdev()
@@ -0,0 +1,63 @@
+# tests of the shared memory frame, with writers in other processes
+import os
+import sys
+import threading
+import subprocess
+import numpy as np
+import calandigital as cd
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+shape    = (2, 16)
+
+writer_code = """
+import sys
+import numpy as np
+import calandigital as cd
+shared_frame = cd.SharedFrame(sys.argv[1], (2, 16), np.uint64, create=True)
+shared_frame.write(np.full((2, 16), int(sys.argv[2])))
+print("ready", flush=True)
+sys.stdin.readline()
+shared_frame.close()
+"""
+
+def start_writer(name, value):
+    """
+    Start a writer process that writes a single frame full of value, and
+    closes the segment when a line is sent to its stdin.
+    """
+    writer = subprocess.Popen([sys.executable, "-c", writer_code, name, str(value)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, cwd=repo_dir)
+    assert writer.stdout.readline().strip() == "ready"
+    return writer
+
+def stop_writer(writer):
+    writer.communicate("\n", timeout=10)
+    assert writer.returncode == 0
+
+def read_frame(shared_frame, **kwargs):
+    """
+    read_frame() with a timeout, in case the new frame is never detected.
+    """
+    result = []
+    thread = threading.Thread(target=lambda: result.append(shared_frame.read_frame(**kwargs)),
+        daemon=True)
+    thread.start()
+    thread.join(10)
+    assert result, "new frame not detected"
+    return result[0]
+
+def test_reattach_new_segment():
+    name = "cd_test_" + str(os.getpid())
+    writer = start_writer(name, 1)
+    reader = cd.SharedFrame(name, shape, np.uint64)
+    try:
+        seq, _, frame = read_frame(reader)
+        assert seq == 1 and np.all(frame == 1)
+        # the writer is restarted with a new segment with the same name
+        stop_writer(writer)
+        writer = start_writer(name, 2)
+        seq, _, frame = read_frame(reader, last_seq=seq, reattach_time=0.05)
+        assert seq == 1 and np.all(frame == 2)
+    finally:
+        reader.close()
+        stop_writer(writer)
@@ -0,0 +1,89 @@
+# tests of the DSS calibration and SRR scripts against the simulated RFSoC
+import os
+import re
+import sys
+import shutil
+import numpy as np
+import pytest
+import matplotlib
+matplotlib.use("Agg")
+import calandigital as cd
+
+pytest.importorskip("pyvisa")
+pytest.importorskip("tomli")
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+scripts  = ["dss_common", "dss_calibrate", "dss_compute_srr", "dss_load_constants"]
+
+def make_script_dir(tmp_path, script_dir, config_file, fpg_devices=None):
+    """
+    Copy the DSS scripts and their config into tmp_path, with the config set
+    to simulate an unbalanced receiver (and the RF generator) and to sweep
+    few bins.
+    """
+    for script in scripts:
+        shutil.copy(os.path.join(repo_dir, script_dir, script + ".py"), tmp_path)
+    with open(os.path.join(repo_dir, script_dir, config_file)) as f:
+        config = f.read()
+    config = "simulate = true\n" + config
+    config = re.sub(r"(?m)^acc_len *=.*$", "acc_len = 1000", config)
+    config = re.sub(r"(?m)^bin_step *=.*$", "bin_step = 128", config)
+    config = re.sub(r"(?m)^spec_step *=.*$", "spec_step = 4", config)
+    config += "\n[simulation]\ngains = [1.0, 1.2, 1.0, 1.2]\nphases = [0.0, 10.0, 0.0, 10.0]\n"
+    with open(tmp_path / config_file, "w") as f:
+        f.write(config)
+    bitfile = re.search(r'bitfile *= *"(.*)"', config).group(1)
+    if fpg_devices is None:
+        shutil.copy(os.path.join(repo_dir, script_dir, bitfile), tmp_path)
+    else:
+        # the model .fpg is not in the repository, write its register map
+        with open(tmp_path / bitfile, "w") as f:
+            for i, device in enumerate(fpg_devices):
+                f.write("?register\t%s\t0x%x\t0x1000\n" % (device, 0xa0000000 + i*0x1000))
+            f.write("?quit\n")
+
+def run_calibration_and_srr(tmp_path, monkeypatch):
+    """
+    Run dss_calibrate and dss_compute_srr in tmp_path.
+    :return: SRR of the usb and lsb tones at the test bins, in dB.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    for script in scripts:
+        monkeypatch.delitem(sys.modules, script, raising=False)
+    import dss_calibrate
+    import dss_compute_srr
+    import dss_common
+    try:
+        dss_calibrate.main([])
+        dss_compute_srr.main([])
+    finally:
+        for script in scripts:
+            sys.modules.pop(script, None)
+
+    srrdata = cd.read_sweep_store(dss_common.srr_datadir + ".cds", prefix="srrdata/")
+    test_bins = list(dss_common.test_bins)
+    srr_usb = 10*np.log10(srrdata["usb_toneusb"] / srrdata["lsb_toneusb"])[test_bins]
+    srr_lsb = 10*np.log10(srrdata["lsb_tonelsb"] / srrdata["usb_tonelsb"])[test_bins]
+    return srr_usb, srr_lsb
+
+def test_dss_calibration_srr(tmp_path, monkeypatch):
+    make_script_dir(tmp_path, "Digital-Sideband-Separation/bitfiles",
+        "dss_2in_2048ch_983mhz_real.toml")
+    srr_usb, srr_lsb = run_calibration_and_srr(tmp_path, monkeypatch)
+    assert np.median(srr_usb) > 40
+    assert np.median(srr_lsb) > 40
+
+def test_mbr_calibration_srr(tmp_path, monkeypatch):
+    import tomllib
+    with open(os.path.join(repo_dir, "Multiband-Receiver/MBR_experiment/mbr_config.toml"), "rb") as f:
+        config = tomllib.load(f)
+    devices = sum(config["spectra"]["bram_names"], [])
+    for section in ["dss1", "dss2"]:
+        devices += sum(config[section]["corr_brams"] + config[section]["synth_brams"] +
+            sum(config[section]["const_brams"], []), [])
+    devices += [config["spectra"]["acc_reg"], config["spectra"]["reset_reg"]]
+    make_script_dir(tmp_path, "Multiband-Receiver/MBR_experiment", "mbr_config.toml", devices)
+    srr_usb, srr_lsb = run_calibration_and_srr(tmp_path, monkeypatch)
+    assert np.median(srr_usb) > 40
+    assert np.median(srr_lsb) > 40
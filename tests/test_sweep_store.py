@@ -0,0 +1,32 @@
+# tests of the sweep store (.cds) files
+import numpy as np
+import pytest
+import calandigital as cd
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_empty_store(tmp_path, compress):
+    # a sweep that saved no full spectra (e.g. spec_step = 0) leaves stores
+    # with no rows, as packed by compress_data
+    rawdata = cd.create_sweep_store(str(tmp_path / "rawdata.cds"), 8, 
+        {"a2": (16, "<u8"), "ab": ((2, 16), "<i8")})
+    arrays = {"rawdata/" + field: rawdata[field][:rawdata.count] for field in rawdata.fields}
+    arrays["scalar"] = np.float64(1.5)
+    rawdata.close()
+
+    filename = str(tmp_path / "datadir.cds")
+    cd.write_sweep_store(filename, arrays, {"test": 1}, compress=compress)
+    read_arrays = cd.read_sweep_store(filename)
+    assert read_arrays.keys() == arrays.keys()
+    for name, data in arrays.items():
+        assert read_arrays[name].shape == data.shape
+        assert read_arrays[name].dtype == data.dtype
+        assert np.array_equal(read_arrays[name], data)
+
+def test_store_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    arrays = {"spec": rng.integers(0, 2**40, (37, 64)), "freqs": np.linspace(0, 1, 37)}
+    filename = str(tmp_path / "data.cds")
+    cd.write_sweep_store(filename, arrays, chunk_rows=8)
+    read_arrays = cd.read_sweep_store(filename)
+    for name, data in arrays.items():
+        assert np.array_equal(read_arrays[name], data)
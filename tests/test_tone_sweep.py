@@ -0,0 +1,57 @@
+# tests of the error handling of the pipelined tone sweep
+import time
+import pytest
+import calandigital as cd
+
+class Sweep():
+    """
+    Stages of a sweep that record the steps done, with a failing stage.
+    """
+    def __init__(self, fail_stage=None, fail_step=3):
+        self.fail_stage = fail_stage
+        self.fail_step  = fail_step
+        self.tones = []
+        self.saved = []
+
+    def check(self, stage, step):
+        if stage == self.fail_stage and step >= self.fail_step:
+            raise RuntimeError(stage + " failed")
+
+    def set_tone(self, step):
+        self.tones.append(step)
+        time.sleep(1e-3)
+
+    def settle(self, step):
+        pass
+
+    def read(self, step):
+        return [step]
+
+    def plot(self, steps, results):
+        self.check("plot", steps[-1])
+
+    def save(self, step, data):
+        self.check("save", step)
+        self.saved.append(step)
+
+def run_sweep(sweep, nsteps=200):
+    return cd.run_tone_sweep(range(nsteps), sweep.set_tone, sweep.settle, sweep.read,
+        sweep.plot, sweep.save)
+
+def test_sweep():
+    sweep = Sweep()
+    results, timing = run_sweep(sweep)
+    assert results == [[step] for step in range(200)]
+    assert sweep.saved == list(range(200))
+
+@pytest.mark.parametrize("fail_stage", ["plot", "save"])
+def test_sweep_stops_on_error(fail_stage):
+    sweep = Sweep(fail_stage)
+    with pytest.raises(RuntimeError, match=fail_stage + " failed"):
+        run_sweep(sweep)
+    # the sweep threads are stopped when the error is raised
+    ntones = len(sweep.tones)
+    time.sleep(0.05)
+    assert len(sweep.tones) == ntones < 200
+    if fail_stage == "save":
+        assert sweep.saved == [0, 1, 2]
@@ -0,0 +1,46 @@
+# tests of the writes into brams with a shadow copy
+import os
+import tomllib
+import numpy as np
+import calandigital as cd
+
+dss_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "Digital-Sideband-Separation/bitfiles")
+
+class CountingRFSoC():
+    """
+    Wrapper of a rfsoc that counts the reads.
+    """
+    def __init__(self, rfsoc):
+        self.rfsoc = rfsoc
+        self.nreads = 0
+
+    def read(self, device, size, offset=0):
+        self.nreads += 1
+        return self.rfsoc.read(device, size, offset)
+
+    def write(self, device, data, offset=0):
+        self.rfsoc.write(device, data, offset)
+
+def test_write_constants(monkeypatch):
+    monkeypatch.chdir(dss_dir)
+    with open("dss_2in_2048ch_983mhz_real.toml", "rb") as f:
+        config = tomllib.load(f)
+    sim_rfsoc = cd.SimRFSoC(config["bitfile"], config)
+    rfsoc  = CountingRFSoC(sim_rfsoc)
+    brams  = sum(sum(config["dss"]["const_brams"], []), [])
+    data   = np.random.default_rng(0).integers(-2**31, 2**31, (len(brams), 512)).astype(">i4")
+    shadow = {}
+
+    # the brams missing in the shadow are read back in a single merged read
+    nbytes = cd.write_bram_data(rfsoc, dict(zip(brams, data)), shadow, regmap=sim_rfsoc.regmap)
+    assert rfsoc.nreads == 1
+    assert nbytes == data.nbytes
+    for bram, bram_data in zip(brams, data):
+        assert sim_rfsoc.read(bram, 2048) == bram_data.tobytes() == shadow[bram]
+
+    # only the changed words are written
+    data[3, 100] += 1
+    assert cd.write_bram_data(rfsoc, dict(zip(brams, data)), shadow) == 4
+    assert rfsoc.nreads == 1
+    assert sim_rfsoc.read(brams[3], 2048) == data[3].tobytes()